@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Benchmark cache backends on many small entries.
+
+Usage: cache_backends.py [number of entries, default 10000]
+"""
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import reproducible
+
+
+def measure(cache, count):
+    values = [reproducible.get_data_wrapper({'index': i, 'value': i * 0.5})
+              for i in range(count)]
+
+    start = time.time()
+    for i, value in enumerate(values):
+        cache.set('key%d' % i, value)
+    if hasattr(cache, 'flush'):
+        cache.flush()
+    write = time.time() - start
+
+    start = time.time()
+    for i in range(count):
+        cache.get_or_miss('key%d' % i)
+    read = time.time() - start
+
+    start = time.time()
+    for i in range(count):
+        cache.get_or_miss('missing%d' % i)
+    miss = time.time() - start
+
+    return write, read, miss
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    root = tempfile.mkdtemp()
+    try:
+        backends = [
+            ('FileCache', reproducible.FileCache(os.path.join(root, 'files'))),
+            ('SqliteCache',
+             reproducible.SqliteCache(os.path.join(root, 'cache.db'))),
+        ]
+        print('%-12s %10s %10s %10s' % ('', 'set', 'hit', 'miss'))
+        for name, cache in backends:
+            write, read, miss = measure(cache, count)
+            print('%-12s %8.1f us %7.1f us %7.1f us' % (
+                name, write / count * 1e6, read / count * 1e6,
+                miss / count * 1e6))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
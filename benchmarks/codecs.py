@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""Benchmark compression ratio and decode throughput of cache codecs."""
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import json
+import time
+
+import numpy
+
+import reproducible
+from reproducible import codec
+
+
+def sample_payloads():
+    rng = numpy.random.RandomState(0)
+    return [
+        ('pickled dict', reproducible.get_data_wrapper(
+            dict(('parameter%d' % i, [i * 0.5, 'label%d' % (i % 10)])
+                 for i in range(100000))).dumps()),
+        ('JSON text', json.dumps(
+            {'weights': [list(rng.randn(100).round(3))
+                         for _ in range(1000)]}).encode('utf8')),
+        ('smooth array', reproducible.get_data_wrapper(
+            numpy.cumsum(rng.randint(-1, 2, 2000000))).dumps()),
+        ('random array', reproducible.get_data_wrapper(
+            rng.randn(1000000)).dumps()),
+    ]
+
+
+def main():
+    print('%-14s %-6s %8s %14s' % ('payload', 'codec', 'ratio', 'decode'))
+    for payload_name, payload in sample_payloads():
+        for codec_name in codec.available_codecs():
+            c = codec.get_codec(codec_name)
+            compressor = c.compressor()
+            compressed = compressor.compress(payload) + compressor.flush()
+            start = time.time()
+            c.decompress(compressed)
+            elapsed = time.time() - start
+            print('%-14s %-6s %8.2f %9.1f MiB/s' % (
+                payload_name, codec_name, len(payload) / len(compressed),
+                len(payload) / elapsed / 2**20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Benchmark file hashing methods over a synthetic file.
+
+Usage: file_hash.py [size in MiB, default 1024]
+"""
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import sys
+import tempfile
+import time
+
+import reproducible
+from reproducible.data import file_hash
+
+
+def hash_small_chunks(fh):
+    # The method used by FileData before large buffers were introduced.
+    hash_context = reproducible.hash_family()
+    for chunk in iter(lambda: fh.read(1024), b''):
+        hash_context.update(chunk)
+    return hash_context.digest()
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    fd, filename = tempfile.mkstemp()
+    try:
+        block = os.urandom(1 << 20)
+        for _ in range(size):
+            os.write(fd, block)
+        os.close(fd)
+
+        methods = [
+            ('1 KiB reads', hash_small_chunks),
+            ('large buffers', file_hash.hash_file),
+            ('tree, 1 thread',
+             lambda fh: file_hash.tree_hash_file(fh, workers=1)),
+            ('tree, %d threads' % os.cpu_count(),
+             lambda fh: file_hash.tree_hash_file(fh, workers=os.cpu_count())),
+        ]
+        for name, method in methods:
+            with open(filename, 'rb') as fh:
+                start = time.time()
+                method(fh)
+                elapsed = time.time() - start
+            print('%-16s %8.3f s %8.1f MiB/s' % (name, elapsed,
+                                                 size / elapsed))
+    finally:
+        os.unlink(filename)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Benchmark cache hits through a loop of calls against ``map``.
+
+Usage: map.py [number of calls, default 10000]
+"""
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import reproducible
+
+
+@reproducible.operation
+def square(x):
+    return {'index': x, 'value': x * x}
+
+
+def measure(cache, count):
+    reproducible.set_cache(cache)
+    arguments = list(range(count))
+    square.map(arguments)
+    if hasattr(cache, 'flush'):
+        cache.flush()
+
+    start = time.time()
+    for x in arguments:
+        square(x)
+    loop = time.time() - start
+
+    start = time.time()
+    square.map(arguments)
+    bulk = time.time() - start
+
+    return loop, bulk
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    root = tempfile.mkdtemp()
+    try:
+        backends = [
+            ('MemoryCache', reproducible.MemoryCache()),
+            ('FileCache', reproducible.FileCache(os.path.join(root, 'files'))),
+            ('SqliteCache',
+             reproducible.SqliteCache(os.path.join(root, 'cache.db'))),
+        ]
+        print('%-12s %10s %10s' % ('', 'loop', 'map'))
+        for name, cache in backends:
+            loop, bulk = measure(cache, count)
+            print('%-12s %7.1f us %7.1f us' % (
+                name, loop / count * 1e6, bulk / count * 1e6))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
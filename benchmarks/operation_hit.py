@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Benchmark the latency of a cache hit through ``@operation``.
+
+The "before" figure recomputes the source fingerprint on every call, as
+the wrapper did before the fingerprint was memoised; the "after" figure
+uses the memoised fingerprint.
+"""
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import timeit
+
+import reproducible
+import reproducible.wrapper
+
+
+class _RecomputingFingerprint(reproducible.wrapper._SourceFingerprint):
+    def hexdigest(self):
+        self.hash = None
+        return super(_RecomputingFingerprint, self).hexdigest()
+
+
+def make_operation():
+    @reproducible.operation
+    def add(a, b):
+        return a + b
+
+    return add
+
+
+def measure(number=20000):
+    # type: (int) -> float
+    add = make_operation()
+    add(1, 2)
+    return min(timeit.repeat(lambda: add(1, 2), number=number,
+                             repeat=5)) / number
+
+
+def main():
+    reproducible.set_cache(reproducible.MemoryCache())
+
+    memoised = reproducible.wrapper._SourceFingerprint
+    reproducible.wrapper._SourceFingerprint = _RecomputingFingerprint
+    try:
+        before = measure()
+    finally:
+        reproducible.wrapper._SourceFingerprint = memoised
+    after = measure()
+
+    print('hit latency before: %8.2f us' % (before * 1e6))
+    print('hit latency after:  %8.2f us' % (after * 1e6))
+    print('speedup:            %8.2fx' % (before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -18,9 +18,18 @@ import hashlib
 
 from .cache import *
 from .data import *
+from .instrumentation import enable_stats, disable_stats, reset_stats, \
+    stats, dump_stats
+from .sqlite import SqliteCache
 from .wrapper import *
+from .graph import Graph
 
 hash_family = hashlib.sha256
 
-__all__ = ['operation', 'cache_ignore',
-           'set_cache', 'MemoryCache', 'FileCache']
+__all__ = ['operation', 'cache_ignore', 'freeze', 'unfreeze',
+           'set_cache', 'Cache', 'MemoryCache',
+           'BoundedMemoryCache', 'FileCache', 'TieredCache',
+           'SqliteCache', 'LazyData', 'Graph',
+           'FileHashIndex', 'set_file_hash_index', 'MISS',
+           'enable_stats', 'disable_stats', 'reset_stats', 'stats',
+           'dump_stats']
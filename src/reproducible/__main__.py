@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Command-line interface for cache maintenance.
+
+Usage::
+
+    python -m reproducible gc ROOT [--max-bytes SIZE] [--max-entries N]
+                                   [--max-age SECONDS]
+"""
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import argparse
+import os.path
+import sys
+
+import reproducible
+
+_SIZE_SUFFIXES = {'': 1, 'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+
+
+def parse_size(text):
+    # type: (str) -> int
+    """Parse a size in bytes, with an optional K, M, G, or T suffix."""
+    text = text.strip().upper()
+    if text.endswith('B'):
+        text = text[:-1]
+    suffix = text[-1:] if text[-1:] in _SIZE_SUFFIXES else ''
+    try:
+        return int(float(text[:len(text) - len(suffix)]) *
+                   _SIZE_SUFFIXES[suffix])
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid size: %r' % text)
+
+
+def gc(args):
+    # type: (argparse.Namespace) -> int
+    if not os.path.isdir(args.root):
+        print('No such cache directory: %s' % args.root, file=sys.stderr)
+        return 1
+    cache = reproducible.FileCache(args.root)
+    result = cache.gc(max_bytes=args.max_bytes, max_entries=args.max_entries,
+                      max_age=args.max_age)
+    print('Removed %d entries (%d bytes); %d entries (%d bytes) remain.' % (
+        result['removed']['entries'], result['removed']['bytes'],
+        result['remaining']['entries'], result['remaining']['bytes']))
+    return 0
+
+
+def main(argv=None):
+    # type: (list) -> int
+    parser = argparse.ArgumentParser(prog='python -m reproducible')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    gc_parser = subparsers.add_parser(
+        'gc', help='Remove least-recently-used entries from a FileCache.')
+    gc_parser.add_argument('root', help='The root directory of the cache.')
+    gc_parser.add_argument('--max-bytes', type=parse_size,
+                           help='The maximum total size, e.g. 10G.')
+    gc_parser.add_argument('--max-entries', type=int,
+                           help='The maximum number of entries.')
+    gc_parser.add_argument('--max-age', type=float,
+                           help='Remove entries not read for this many '
+                                'seconds.')
+    gc_parser.set_defaults(func=gc)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,15 +3,126 @@
 from __future__ import absolute_import, division, print_function, \
     unicode_literals
 
+import collections
+import contextlib
+import errno
+import hashlib
+import importlib
+import os
 import os.path
 import pickle
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+try:
+    import concurrent.futures
+except ImportError:  # pragma: no cover
+    concurrent = None
 
 import reproducible
 import reproducible.data
+from . import codec as codecs
+from . import instrumentation
+from . import lock
+
+
+# os.replace overwrites the destination atomically on all platforms.
+_replace = getattr(os, 'replace', os.rename)
+
+
+class _Miss(object):
+    """Type of the :data:`MISS` sentinel."""
+    def __repr__(self):
+        return 'reproducible.MISS'
+
+    def __bool__(self):
+        return False
+
+    __nonzero__ = __bool__
+
+
+#: Sentinel returned by :meth:`Cache.get_or_miss` when a key is not cached.
+MISS = _Miss()
 
 
 class Cache(object):
-    pass
+    """Base class for caches.
+
+    A cache maps string keys to :class:`reproducible.Data` objects.
+    Subclasses must implement ``get``, ``set``, and ``is_cached``, and
+    should override :meth:`get_or_miss` if they can perform a lookup more
+    cheaply than ``is_cached`` followed by ``get``.
+
+    The ``lock_timeout`` attribute gives the maximum time in seconds that
+    :meth:`lock` will wait, or None to wait indefinitely.
+    """
+    lock_timeout = None
+
+    def get_or_miss(self, key):
+        """Look up a key in a single operation.
+
+        Args:
+            key (str): The key to look up.
+
+        Return:
+            The cached :class:`reproducible.Data` object, or
+            :data:`reproducible.MISS` if the key is not in the cache.
+        """
+        # type: (str) -> object
+        if self.is_cached(key):
+            return self.get(key)
+        return MISS
+
+    def get_many(self, keys):
+        """Look up several keys at once.
+
+        Backends should override this if they can perform a bulk lookup
+        more cheaply than a series of calls to :meth:`get_or_miss`.
+
+        Args:
+            keys (list): The keys to look up.
+
+        Return:
+            A list holding, for each key, the cached
+            :class:`reproducible.Data` object or :data:`reproducible.MISS`.
+        """
+        # type: (list) -> list
+        return [self.get_or_miss(key) for key in keys]
+
+    def set_many(self, items):
+        """Store several values at once.
+
+        Args:
+            items (list): A list of (key, :class:`reproducible.Data`) pairs.
+        """
+        # type: (list) -> None
+        for key, value in items:
+            self.set(key, value)
+
+    def lock(self, key):
+        """Lock a key while its value is computed.
+
+        :func:`reproducible.operation` holds this lock while computing a
+        value that was not found in the cache, so that other callers with
+        the same key wait for the result rather than computing it again.
+        The default implementation only excludes other threads in the same
+        process; caches shared between processes may also lock out other
+        processes.
+
+        Args:
+            key (str): The key to lock.
+
+        Return:
+            A context manager yielding True if the lock was acquired, or
+            False if the timeout expired.
+        """
+        # type: (str) -> object
+        return lock._key_locks.hold(key, self.lock_timeout)
 
 
 class MemoryCache(Cache):
@@ -32,51 +143,458 @@ class MemoryCache(Cache):
         # type: (str) -> object
         return self.cache.get(key)
 
+    def get_or_miss(self, key):
+        # type: (str) -> object
+        return self.cache.get(key, MISS)
+
+    def get_many(self, keys):
+        # type: (list) -> list
+        get = self.cache.get
+        return [get(key, MISS) for key in keys]
+
+    def is_cached(self, key):
+        # type: (str) -> bool
+        return key in self.cache
+
+
+def _estimate_size(value):
+    # type: (reproducible.data.Data) -> int
+    nbytes = getattr(value.value, 'nbytes', None)
+    if isinstance(nbytes, int):
+        return nbytes
+    return len(value.dumps())
+
+
+class BoundedMemoryCache(MemoryCache):
+    """Memory-backed cache with a size limit.
+
+    BoundedMemoryCache behaves like :class:`MemoryCache`, but evicts the
+    least-recently-used entries once either the number of entries or their
+    estimated total size exceeds a limit.  The size of an entry is taken
+    from the ``nbytes`` attribute of its value if it has one (for example
+    a :class:`numpy.ndarray`), and otherwise from the length of its
+    serialised form.
+
+    The attributes ``hits``, ``misses``, and ``evictions`` count cache
+    accesses, and ``size`` holds the current estimated total size in bytes.
+    The cache may be shared between threads.
+    """
+    def __init__(self, max_entries=None, max_bytes=None):
+        """
+        Args:
+            max_entries (int): The maximum number of entries, or None for
+                no limit.
+            max_bytes   (int): The maximum total estimated size of all
+                entries in bytes, or None for no limit.
+        """
+        # type: (int, int) -> None
+        super(BoundedMemoryCache, self).__init__()
+        self.cache = collections.OrderedDict()
+        self.sizes = {}
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._mutex = threading.Lock()
+
+    def set(self, key, value):
+        # type: (str, reproducible.data.Data) -> None
+        size = _estimate_size(value) if self.max_bytes is not None else 0
+        with self._mutex:
+            self.__remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self.cache[key] = value
+            self.sizes[key] = size
+            self.size += size
+            while ((self.max_entries is not None
+                    and len(self.cache) > self.max_entries)
+                   or (self.max_bytes is not None
+                       and self.size > self.max_bytes)):
+                self.__remove(next(iter(self.cache)))
+                self.evictions += 1
+
+    def get(self, key):
+        # type: (str) -> object
+        value = self.get_or_miss(key)
+        return None if value is MISS else value
+
+    def get_or_miss(self, key):
+        # type: (str) -> object
+        with self._mutex:
+            value = self.cache.get(key, MISS)
+            if value is MISS:
+                self.misses += 1
+            else:
+                self.__touch(key)
+                self.hits += 1
+            return value
+
+    def get_many(self, keys):
+        # type: (list) -> list
+        return [self.get_or_miss(key) for key in keys]
+
     def is_cached(self, key):
         # type: (str) -> bool
-        return key in self.cache.keys()
+        with self._mutex:
+            return key in self.cache
+
+    def __touch(self, key):
+        # type: (str) -> None
+        try:
+            self.cache.move_to_end(key)
+        except AttributeError:  # pragma: no cover
+            # Python 2 has no OrderedDict.move_to_end.
+            self.cache[key] = self.cache.pop(key)
+
+    def __remove(self, key):
+        # type: (str) -> None
+        if key in self.cache:
+            del self.cache[key]
+            self.size -= self.sizes.pop(key)
+
+
+def _type_identifier(data_type):
+    # type: (type) -> bytes
+    name = getattr(data_type, '__qualname__', data_type.__name__)
+    return ('%s:%s' % (data_type.__module__, name)).encode('utf8')
+
+
+def _resolve_type_identifier(identifier):
+    # type: (bytes) -> type
+    module_name, name = identifier.decode('utf8').split(':', 1)
+    obj = importlib.import_module(module_name)
+    for part in name.split('.'):
+        obj = getattr(obj, part)
+    return obj
+
+
+def _byte_view(data):
+    """View written data as a sequence of bytes, without copying it."""
+    if sys.version_info[0] < 3:  # pragma: no cover
+        # Python 2 cannot measure, checksum, or compress a memoryview.
+        return data.tobytes() if isinstance(data, memoryview) else data
+    return memoryview(data).cast('B')
+
+
+class _ChecksumFile(object):
+    """Write-only file wrapper that tracks the length and CRC of its input."""
+    def __init__(self, fh):
+        self.fh = fh
+        self.length = 0
+        self.checksum = 0
+
+    def write(self, data):
+        data = _byte_view(data)
+        self.fh.write(data)
+        self.length += len(data)
+        self.checksum = zlib.crc32(data, self.checksum)
+        return len(data)
+
+    def flush(self):
+        self.fh.flush()
+
+
+class _CompressingFile(object):
+    """Write-only file wrapper that compresses its input on the fly.
+
+    The first ``threshold`` bytes are held in memory.  Payloads shorter
+    than that, and those whose first bytes do not shrink when compressed,
+    are passed through uncompressed.  Once all of the input has been
+    written, :meth:`finish` must be called; ``codec`` is then the codec
+    with which the output was compressed, or None.
+    """
+    def __init__(self, fh, codec, threshold):
+        # type: (object, codecs.Codec, int) -> None
+        self.fh = fh
+        self.codec = codec
+        self.threshold = threshold
+        self.prefix = bytearray()
+        self.compressor = None
+        self.decided = False
+
+    def write(self, data):
+        if self.decided:
+            if self.compressor is None:
+                self.fh.write(data)
+            else:
+                self.fh.write(self.compressor.compress(data))
+        else:
+            # Buffer no more than the prefix, so that large writes such as
+            # array buffers are not copied.
+            data = _byte_view(data)
+            needed = max(self.threshold, 1) - len(self.prefix)
+            self.prefix += data[:needed]
+            if len(self.prefix) >= max(self.threshold, 1):
+                self.__decide()
+                if len(data) > needed:
+                    self.write(data[needed:])
+        return len(data)
+
+    def __decide(self):
+        # type: () -> None
+        prefix = bytes(self.prefix)
+        trial = self.codec.compressor()
+        if len(trial.compress(prefix) + trial.flush()) < len(prefix):
+            self.compressor = self.codec.compressor()
+            self.fh.write(self.compressor.compress(prefix))
+        else:
+            self.codec = None
+            self.fh.write(prefix)
+        self.prefix = None
+        self.decided = True
+
+    def flush(self):
+        pass
+
+    def finish(self):
+        # type: () -> None
+        if not self.decided:
+            self.codec = None
+            self.fh.write(bytes(self.prefix))
+            self.prefix = None
+            self.decided = True
+        elif self.compressor is not None:
+            self.fh.write(self.compressor.flush())
 
 
 class FileCache(Cache):
     """Disk-backed cache.
 
     FileCache provides a key-value store on disk.  Each item in the cache
-    has a directory, named for its key.  The directory contains two files:
+    is stored in a single file named for its key, in a subdirectory named
+    for the first two hexadecimal digits of the hash of the key so that no
+    single directory grows too large.  The file begins with a fixed-size
+    header:
+
+        - magic number ``RPRC``,
+        - format version,
+        - identifier of the compression codec, or zero if uncompressed,
+        - length of the data type identifier,
+        - offset of the payload from the start of the file,
+        - length of the payload,
+        - CRC-32 checksum of the payload,
+
+    followed by the data type identifier (``module:qualified.name``) and
+    the payload, which is aligned to a 64-byte boundary so that it can be
+    memory-mapped.  As the objects in question are of type
+    reproducible.Data, we can use the data type to get access to the
+    appropriate .load() class method.
+
+    Payloads may be compressed with one of the codecs in
+    :mod:`reproducible.codec`, chosen per cache and per data type.  Payloads
+    smaller than a threshold, or whose first bytes do not shrink when
+    compressed, are stored uncompressed.  Compressed arrays cannot be
+    memory-mapped.
 
-        - /type: The pickled object type.
-        - /data: The serialised data itself.
+    Entries are written to a temporary file within the cache root and then
+    renamed into place, so that readers never see a partially written
+    entry, even if the writer is interrupted.  Several processes may
+    safely share a cache directory.
 
-    As the objects in question are of type reproducible.Data, we can use
-    the unpickled type object to get access to the appropriate
-    .load() class method.
+    The modification time of each entry file records when it was last
+    read, to within ``access_resolution`` seconds, so that :meth:`gc` can
+    remove the least-recently-used entries when the cache grows too large.
+
+    Entries in the older directory-per-key layout, with ``data`` and
+    ``type`` files, are still read, but new entries are always written in
+    the packed format.  Such entries are complete if they have a
+    ``committed`` marker, or, if they were written before markers were
+    introduced, if their type file can be unpickled.
     """
+    TEMPORARY_PREFIX = '.tmp-'
+    COMMIT_MARKER = 'committed'
+    MAGIC = b'RPRC'
+    VERSION = 1
+    HEADER = struct.Struct('<4sBBHIQI')
+    ALIGNMENT = 64
+
     @classmethod
     def __check_directory__(cls, root):
         # type: (str) -> bool
         return os.path.isdir(root)
 
-    def __init__(self, root, debug=None):
+    def __init__(self,
+                 root,                     # type: str
+                 debug=None,               # type: bool
+                 fsync=False,              # type: bool
+                 verify=False,             # type: bool
+                 lock_timeout=None,        # type: float
+                 stale_lock_timeout=60.0,  # type: float
+                 codec=None,               # type: str
+                 codec_threshold=4096,     # type: int
+                 type_codecs=None,         # type: dict
+                 access_resolution=60.0,   # type: float
+                 io_workers=8              # type: int
+                 ):
         """
         Args:
-            root   (str): The root directory of the cache.
-            debug (file): A file-like object to which to log cache accesses.
+            root                 (str): The root directory of the cache.
+            debug               (file): A file-like object to which to log
+                cache accesses.
+            fsync               (bool): Whether to flush entries to stable
+                storage before publishing them, so that they survive a
+                system crash.
+            verify              (bool): Whether to check the payload
+                checksum on every read.  This requires the whole payload to
+                be read, and so prevents arrays from being memory-mapped.
+            lock_timeout       (float): The maximum time in seconds to wait
+                for another process computing the same value, or None to
+                wait indefinitely.
+            stale_lock_timeout (float): The time in seconds after which the
+                lock of a process that has stopped responding is broken.
+            codec                (str): The name of the codec with which to
+                compress payloads, or None to store them uncompressed.
+            codec_threshold      (int): The size in bytes below which
+                payloads are stored uncompressed.  Payloads are compressed
+                while they are written, and this many bytes are used to
+                decide whether compression is worthwhile.
+            type_codecs         (dict): A mapping from
+                :class:`reproducible.Data` subclasses to the name of the
+                codec to use for them, overriding ``codec``.
+            access_resolution  (float): The minimum time in seconds between
+                updates of the last-access time of an entry.
+            io_workers           (int): The number of threads with which
+                :meth:`get_many` and :meth:`set_many` access entries.
         """
-        # type: (str, bool) -> None
+        # type: (...) -> None
         super(FileCache, self).__init__()
         if not self.__check_directory__(root):
             os.mkdir(root)
         self.root = root
         self.debug = debug
+        self.fsync = fsync
+        self.verify = verify
+        self.lock_timeout = lock_timeout
+        self.stale_lock_timeout = stale_lock_timeout
+        self.codec = codecs.get_codec(codec)
+        self.codec_threshold = codec_threshold
+        self.type_codecs = dict(
+            (data_type, codecs.get_codec(name))
+            for data_type, name in (type_codecs or {}).items())
+        self.access_resolution = access_resolution
+        self.io_workers = io_workers
+
+    def path(self, key):
+        # type: (str) -> str
+        """The path of the file holding an entry."""
+        shard = hashlib.sha256(key.encode('utf8')).hexdigest()[:2]
+        return os.path.join(self.root, shard, key)
 
     def is_cached(self, key):
         # type: (str) -> bool
-        return self.__check_directory__(os.path.join(self.root, key))
+        return os.path.exists(self.path(key)) or self.__is_legacy_entry(
+            os.path.join(self.root, key))
 
     def get(self, key):
         # type: (str) -> object
         if self.debug:
             print("GET %s\n -> " % (key, ), file=self.debug, end="")
+        value = self.__read(key)
+        if value is MISS:
+            raise KeyError(key)
+        return value
+
+    def get_or_miss(self, key):
+        # type: (str) -> object
+        if self.debug:
+            print("GET %s\n -> " % (key, ), file=self.debug, end="")
+        value = self.__read(key)
+        if value is MISS and self.debug:
+            print("MISS", file=self.debug)
+        return value
+
+    def __map(self, function, items):
+        # type: (object, list) -> list
+        workers = min(self.io_workers, len(items))
+        if concurrent is None or workers <= 1:
+            return [function(item) for item in items]
+        # Hand each thread a contiguous run of items, rather than one item
+        # at a time, so that scheduling does not dominate when the entries
+        # are already in the page cache.
+        size = -(-len(items) // workers)
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            chunks = pool.map(
+                lambda chunk: [function(item) for item in chunk],
+                [items[i:i + size] for i in range(0, len(items), size)])
+            return [result for chunk in chunks for result in chunk]
+
+    def get_many(self, keys):
+        """Look up several keys at once, reading entries in parallel."""
+        # type: (list) -> list
+        return self.__map(self.get_or_miss, keys)
+
+    def set_many(self, items):
+        """Store several values at once, writing entries in parallel."""
+        # type: (list) -> None
+        self.__map(lambda item: self.set(*item), items)
+
+    def __read(self, key):
+        # type: (str) -> object
+        start = instrumentation.clock() if instrumentation.enabled else None
+        try:
+            with open(self.path(key), 'rb') as fh:
+                value = self.__read_packed(fh)
+                if start is not None:
+                    instrumentation.record_read(
+                        instrumentation.clock() - start,
+                        os.fstat(fh.fileno()).st_size)
+                return value
+        except (IOError, OSError) as e:
+            if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+        try:
+            value = self.__read_legacy(key)
+            if start is not None:
+                instrumentation.record_read(
+                    instrumentation.clock() - start, 0)
+            return value
+        except (IOError, OSError) as e:
+            if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+        return MISS
+
+    def __read_packed(self, fh):
+        # type: (io.BufferedReader) -> object
+        header = fh.read(self.HEADER.size)
+        if len(header) != self.HEADER.size:
+            raise IOError('Truncated cache entry %s' % fh.name)
+        magic, version, codec_identifier, type_length, offset, length, \
+            checksum = self.HEADER.unpack(header)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise IOError('Unrecognised cache entry %s' % fh.name)
+        data_type = _resolve_type_identifier(fh.read(type_length))
+        st = os.fstat(fh.fileno())
+        if st.st_size != offset + length:
+            raise IOError('Truncated cache entry %s' % fh.name)
+        now = time.time()
+        if now - st.st_mtime > self.access_resolution:
+            try:
+                os.utime(fh.name, (now, now))
+            except OSError:
+                pass
+        codec = codecs.get_codec_by_identifier(codec_identifier)
+        fh.seek(offset)
+        if self.debug or self.verify or codec is not None:
+            data = fh.read(length)
+            if self.verify and zlib.crc32(data) & 0xffffffff != checksum:
+                raise IOError('Corrupt cache entry %s' % fh.name)
+            if self.debug:
+                hash_context = reproducible.hash_family()
+                hash_context.update(data)
+                print(hash_context.hexdigest(), file=self.debug)
+            if codec is not None:
+                data = codec.decompress(data)
+            return data_type.loads(data)
+        return data_type.load(fh)
+
+    def __read_legacy(self, key):
+        # type: (str) -> object
         base_path = os.path.join(self.root, key)
+        if not self.__is_legacy_entry(base_path):
+            raise IOError(errno.ENOENT, 'No cache entry', base_path)
         with open(os.path.join(base_path, 'data'), 'rb') as fh, \
              open(os.path.join(base_path, 'type'), 'rb') as fh_type:
             data_type = pickle.load(fh_type)
@@ -88,17 +606,282 @@ class FileCache(Cache):
                 return data_type.loads(data)
             return data_type.load(fh)
 
+    def __is_legacy_entry(self, base_path):
+        # type: (str) -> bool
+        """Determine whether a directory holds a complete legacy entry."""
+        if os.path.exists(os.path.join(base_path, self.COMMIT_MARKER)):
+            return True
+        if not os.path.exists(os.path.join(base_path, 'data')):
+            return False
+        # Entries from before commit markers wrote their type file last.
+        try:
+            with open(os.path.join(base_path, 'type'), 'rb') as fh:
+                data_type = pickle.load(fh)
+        except Exception:
+            return False
+        return isinstance(data_type, type) and \
+            issubclass(data_type, reproducible.Data)
+
+    def __make_shard(self, path):
+        # type: (str) -> None
+        try:
+            os.mkdir(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    @contextlib.contextmanager
+    def lock(self, key):
+        """Lock a key against other threads and processes.
+
+        The lock is held by creating a ``.lock`` file next to the entry.
+        """
+        with super(FileCache, self).lock(key) as acquired:
+            if not acquired:
+                yield False
+                return
+            path = self.path(key)
+            self.__make_shard(path)
+            file_lock = lock.FileLock(path + '.lock', self.lock_timeout,
+                                      self.stale_lock_timeout)
+            with file_lock.hold() as acquired:
+                yield acquired
+
     def set(self, key, value):
         # type: (str, reproducible.data.Data) -> None
         if self.debug:
             print('SET %s' % key, file=self.debug)
-        base_path = os.path.join(self.root, key)
-        if not self.__check_directory__(base_path):
-            os.mkdir(base_path)
-        with open(os.path.join(base_path, 'data'), 'wb') as fh, \
-             open(os.path.join(base_path, 'type'), 'wb') as fh_type:
-            value.dump(fh)
-            pickle.dump(type(value), fh_type)
+        path = self.path(key)
+        self.__make_shard(path)
+
+        type_identifier = _type_identifier(type(value))
+        temporary_path = self.__write_entry(
+            type_identifier, value.dump, self.__codec_for(type(value)))
+        try:
+            if instrumentation.enabled:
+                instrumentation.record_write(os.path.getsize(temporary_path))
+            _replace(temporary_path, path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.unlink(temporary_path)
+
+    def __entries(self):
+        """List the entries in the cache, removing leftover files.
+
+        Return:
+            A list of (last access time, size, path, is legacy) tuples.
+        """
+        # type: () -> list
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                if name.startswith(self.TEMPORARY_PREFIX):
+                    # Abandoned by an interrupted writer.
+                    if now - os.lstat(path).st_mtime > 3600:
+                        self.__remove(path)
+                elif not self.__is_shard(name):
+                    # An entry in the directory-per-key layout, which is
+                    # garbage if it was never completed.
+                    files = [os.stat(os.path.join(path, f))
+                             for f in os.listdir(path)]
+                    complete = files and self.__is_legacy_entry(path)
+                    entries.append((
+                        max(st.st_mtime for st in files) if complete else 0,
+                        sum(st.st_size for st in files), path, True))
+                else:
+                    for entry_name in os.listdir(path):
+                        entry_path = os.path.join(path, entry_name)
+                        st = os.stat(entry_path)
+                        if entry_name.endswith('.lock'):
+                            if now - st.st_mtime > self.stale_lock_timeout:
+                                os.unlink(entry_path)
+                        else:
+                            entries.append((st.st_mtime, st.st_size,
+                                            entry_path, False))
+            except OSError as e:
+                # Removed by another process while we were looking.
+                if e.errno != errno.ENOENT:
+                    raise
+        return entries
+
+    @staticmethod
+    def __is_shard(name):
+        # type: (str) -> bool
+        return len(name) == 2 and all(c in '0123456789abcdef' for c in name)
+
+    def __remove(self, path):
+        # type: (str) -> None
+        if os.path.isdir(path):
+            # Rename first, so that the directory vanishes atomically.
+            stale_path = tempfile.mktemp(prefix=self.TEMPORARY_PREFIX,
+                                         dir=self.root)
+            os.rename(path, stale_path)
+            shutil.rmtree(stale_path, ignore_errors=True)
+        else:
+            os.unlink(path)
+
+    def gc(self, max_bytes=None, max_entries=None, max_age=None):
+        """Remove entries from the cache.
+
+        Entries that have not been read for ``max_age`` seconds are
+        removed, followed by the least-recently-used entries until the
+        cache is within the given limits.  Temporary files left behind by
+        interrupted writers and stale lock files are removed as well.  It
+        is safe to collect garbage while other processes are using the
+        cache, though they may then need to recompute removed entries.
+
+        Args:
+            max_bytes   (int): The maximum total size of the entries, or
+                None for no limit.
+            max_entries (int): The maximum number of entries, or None for
+                no limit.
+            max_age   (float): The maximum time in seconds since an entry
+                was last read, or None for no limit.
+
+        Return:
+            A dictionary giving the number and total size of the
+            ``remaining`` and ``removed`` entries.
+        """
+        # type: (int, int, float) -> dict
+        entries = sorted(self.__entries())
+        total_bytes = sum(entry[1] for entry in entries)
+        removed_entries = removed_bytes = 0
+        now = time.time()
+        for last_access, size, path, _ in entries:
+            if not ((max_age is not None and now - last_access > max_age)
+                    or (max_bytes is not None and total_bytes > max_bytes)
+                    or (max_entries is not None
+                        and len(entries) - removed_entries > max_entries)):
+                break
+            try:
+                self.__remove(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            total_bytes -= size
+            removed_entries += 1
+            removed_bytes += size
+        return {
+            'remaining': {'entries': len(entries) - removed_entries,
+                          'bytes': total_bytes},
+            'removed': {'entries': removed_entries, 'bytes': removed_bytes},
+        }
+
+    def __codec_for(self, data_type):
+        # type: (type) -> codecs.Codec
+        for base in data_type.__mro__:
+            if base in self.type_codecs:
+                return self.type_codecs[base]
+        return self.codec
+
+    def __write_entry(self, type_identifier, write_payload, codec):
+        # type: (bytes, object, codecs.Codec) -> str
+        offset = self.HEADER.size + len(type_identifier)
+        offset += -offset % self.ALIGNMENT
+
+        fd, temporary_path = tempfile.mkstemp(prefix=self.TEMPORARY_PREFIX,
+                                              dir=self.root)
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(b'\0' * offset)
+                payload = _ChecksumFile(fh)
+                if codec is None:
+                    write_payload(payload)
+                else:
+                    compressing = _CompressingFile(payload, codec,
+                                                   self.codec_threshold)
+                    write_payload(compressing)
+                    compressing.finish()
+                    codec = compressing.codec
+                fh.seek(0)
+                fh.write(self.HEADER.pack(
+                    self.MAGIC, self.VERSION,
+                    0 if codec is None else codec.identifier,
+                    len(type_identifier), offset, payload.length,
+                    payload.checksum & 0xffffffff))
+                fh.write(type_identifier)
+                if self.fsync:
+                    fh.flush()
+                    os.fsync(fh.fileno())
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+        return temporary_path
+
+
+class TieredCache(Cache):
+    """Memory cache in front of another cache.
+
+    TieredCache serves lookups from a bounded in-memory cache where
+    possible, falling back to a slower persistent cache such as
+    :class:`FileCache`.  Entries read from the persistent cache are
+    promoted to memory, and new entries are written to both, so that
+    repeated hits within one process do not need to touch the disk.
+    """
+    def __init__(self, backing, memory=None):
+        """
+        Args:
+            backing (reproducible.Cache): The persistent cache.
+            memory  (reproducible.Cache): The in-memory cache, by default a
+                :class:`BoundedMemoryCache` holding 1024 entries.
+        """
+        # type: (Cache, Cache) -> None
+        super(TieredCache, self).__init__()
+        if memory is None:
+            memory = BoundedMemoryCache(max_entries=1024)
+        self.backing = backing
+        self.memory = memory
+
+    def set(self, key, value):
+        # type: (str, reproducible.data.Data) -> None
+        self.backing.set(key, value)
+        self.memory.set(key, value)
+
+    def get(self, key):
+        # type: (str) -> object
+        value = self.memory.get_or_miss(key)
+        if value is MISS:
+            value = self.backing.get(key)
+            if value is None or value is MISS:
+                return None
+            self.memory.set(key, value)
+        return value
+
+    def get_or_miss(self, key):
+        # type: (str) -> object
+        value = self.memory.get_or_miss(key)
+        if value is MISS:
+            value = self.backing.get_or_miss(key)
+            if value is not MISS:
+                self.memory.set(key, value)
+        return value
+
+    def get_many(self, keys):
+        # type: (list) -> list
+        values = self.memory.get_many(keys)
+        missing = [i for i, value in enumerate(values) if value is MISS]
+        if missing:
+            backing_values = self.backing.get_many([keys[i] for i in missing])
+            for i, value in zip(missing, backing_values):
+                if value is not MISS:
+                    self.memory.set(keys[i], value)
+                    values[i] = value
+        return values
+
+    def set_many(self, items):
+        # type: (list) -> None
+        items = list(items)
+        self.backing.set_many(items)
+        self.memory.set_many(items)
+
+    def is_cached(self, key):
+        # type: (str) -> bool
+        return self.memory.is_cached(key) or self.backing.is_cached(key)
+
+    def lock(self, key):
+        return self.backing.lock(key)
 
 
 def set_cache(cache):
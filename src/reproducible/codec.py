@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Compression codecs for cache payloads.
+
+Each codec has a name, by which it is selected, and a small integer
+identifier, which is recorded with each cache entry so that entries can be
+read whatever the current settings.
+"""
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import bz2
+import zlib
+
+try:
+    import lzma
+except ImportError:  # pragma: no cover
+    lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class Codec(object):
+    """A compression codec.
+
+    Args:
+        name              (str): The name of the codec.
+        identifier        (int): The identifier recorded in cache entries.
+        compressor   (function): Returns a new object with ``compress()``
+            and ``flush()`` methods.
+        decompress   (function): Decompresses a complete byte string.
+    """
+    def __init__(self, name, identifier, compressor, decompress):
+        self.name = name
+        self.identifier = identifier
+        self.compressor = compressor
+        self.decompress = decompress
+
+    def __repr__(self):
+        return 'Codec(%r)' % self.name
+
+
+_codecs_by_name = {}
+_codecs_by_identifier = {}
+
+
+def register_codec(codec):
+    """Make a codec available for use by caches."""
+    # type: (Codec) -> None
+    _codecs_by_name[codec.name] = codec
+    _codecs_by_identifier[codec.identifier] = codec
+
+
+def get_codec(name):
+    """Find a codec by name.
+
+    Args:
+        name (str): The name of the codec, or None for no compression.
+
+    Return:
+        The :class:`Codec`, or None for no compression.
+    """
+    # type: (str) -> Codec
+    if name is None or name == 'raw':
+        return None
+    try:
+        return _codecs_by_name[name]
+    except KeyError:
+        raise ValueError('Unknown codec %r' % name)
+
+
+def get_codec_by_identifier(identifier):
+    """Find a codec by the identifier recorded in a cache entry."""
+    # type: (int) -> Codec
+    if identifier == 0:
+        return None
+    try:
+        return _codecs_by_identifier[identifier]
+    except KeyError:
+        raise IOError('Unknown codec identifier %d' % identifier)
+
+
+def available_codecs():
+    """The names of the codecs that can be used in this interpreter."""
+    # type: () -> list
+    return sorted(_codecs_by_name)
+
+
+register_codec(Codec('zlib', 1, zlib.compressobj, zlib.decompress))
+register_codec(Codec('bz2', 2, bz2.BZ2Compressor, bz2.decompress))
+if lzma is not None:
+    register_codec(Codec('lzma', 3, lzma.LZMACompressor, lzma.decompress))
+if zstandard is not None:  # pragma: no cover
+    register_codec(Codec(
+        'zstd', 4, lambda: zstandard.ZstdCompressor().compressobj(),
+        # Streaming frames do not record their size, which the one-shot
+        # decompress needs; a decompression object grows its output.
+        lambda data: zstandard.ZstdDecompressor().decompressobj()
+        .decompress(data)))
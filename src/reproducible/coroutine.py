@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Caching of coroutine functions.
+
+This module uses ``async def``, and so is imported only when a coroutine
+function is decorated with :func:`reproducible.operation`.
+"""
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import asyncio
+import collections
+import functools
+
+import reproducible
+from . import instrumentation
+from .wrapper import _materialise, _value
+
+
+def wrap_coroutine(func, make_cache_key, stats_name):
+    """Make a coroutine function cacheable.
+
+    Cache lookups and writes are run on the default executor of the event
+    loop, so that slow caches such as :class:`reproducible.FileCache` do
+    not block it.  Concurrent awaits of the same arguments on one event
+    loop share a single computation.
+
+    Args:
+        func         (function): The coroutine function.
+        make_cache_key (function): Computes the cache key for the
+            arguments of a call.
+        stats_name        (str): The name under which to record statistics.
+    """
+    in_flight = {}
+
+    def lookup(cache, cache_keys):
+        # type: (reproducible.Cache, list) -> list
+        recorder = instrumentation.recorder(stats_name)
+        try:
+            values = cache.get_many(cache_keys)
+            recorder.lap('lookup_time')
+            for value in values:
+                recorder.count('misses' if value is reproducible.MISS
+                               else 'hits')
+            return values
+        finally:
+            recorder.finish()
+
+    def store(cache, cache_key, result):
+        # type: (reproducible.Cache, str, object) -> None
+        recorder = instrumentation.recorder(stats_name)
+        try:
+            cache.set(cache_key, reproducible.get_data_wrapper(result))
+            recorder.lap('store_time')
+        finally:
+            recorder.finish()
+
+    async def compute(loop, cache, cache_key, args, kwargs):
+        args, kwargs = await loop.run_in_executor(
+            None, _materialise, args, kwargs)
+        start = instrumentation.clock()
+        result = await func(*args, **kwargs)
+        if instrumentation.enabled:
+            instrumentation.get_record(stats_name).compute_time += \
+                instrumentation.clock() - start
+        if isinstance(result, reproducible.LazyData):
+            result = await loop.run_in_executor(None, _value, result)
+        await loop.run_in_executor(None, store, cache, cache_key, result)
+        return result
+
+    def join(loop, cache, cache_key, args, kwargs):
+        # type: (...) -> asyncio.Future
+        task = in_flight.get((loop, cache_key))
+        if task is None:
+            task = loop.create_task(
+                compute(loop, cache, cache_key, args, kwargs))
+            in_flight[(loop, cache_key)] = task
+            task.add_done_callback(
+                lambda _: in_flight.pop((loop, cache_key), None))
+        # Cancelling one caller must not cancel the others' computation.
+        return asyncio.shield(task)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_event_loop()
+        cache = reproducible.get_cache()
+        cache_key = make_cache_key(args, kwargs)
+
+        if (loop, cache_key) not in in_flight:
+            cached, = await loop.run_in_executor(
+                None, lookup, cache, [cache_key])
+            if cached is not reproducible.MISS:
+                return cached.value
+        return await join(loop, cache, cache_key, args, kwargs)
+
+    async def map(*iterables, **kwargs):
+        """Await the function on each set of arguments taken from iterables.
+
+        The cache is looked up once for all of the arguments, and the misses
+        are then computed concurrently.
+
+        Return:
+            A list of the results, in order.
+        """
+        loop = asyncio.get_event_loop()
+        cache = reproducible.get_cache()
+        calls = list(zip(*iterables))
+        cache_keys = [make_cache_key(args, kwargs) for args in calls]
+
+        unique_calls = collections.OrderedDict()
+        for args, cache_key in zip(calls, cache_keys):
+            unique_calls.setdefault(cache_key, args)
+        values = await loop.run_in_executor(None, lookup, cache,
+                                            list(unique_calls))
+
+        results = {}
+        pending = collections.OrderedDict()
+        for (cache_key, args), cached in zip(unique_calls.items(), values):
+            if cached is not reproducible.MISS:
+                results[cache_key] = cached.value
+            else:
+                pending[cache_key] = join(loop, cache, cache_key, args,
+                                          kwargs)
+        if pending:
+            results.update(zip(pending,
+                               await asyncio.gather(*pending.values())))
+        return [results[cache_key] for cache_key in cache_keys]
+
+    wrapper.map = map
+    return wrapper
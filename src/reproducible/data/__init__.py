@@ -3,5 +3,10 @@
 from __future__ import absolute_import, division, print_function, \
     unicode_literals
 
-from .generic import Data, ObjectData, FileData, get_data_wrapper, \
-    register_type, cache_ignore, cache_ignored
+from .generic import Data, ObjectData, FileData, LazyData, \
+    get_data_wrapper, \
+    register_type, cache_ignore, cache_ignored, freeze, unfreeze, \
+    get_cache_id
+from .numpy import ArrayData
+from .hash_index import FileHashIndex, set_file_hash_index, \
+    get_file_hash_index
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import hashlib
+import mmap
+import os
+
+import reproducible
+
+try:
+    import concurrent.futures
+except ImportError:  # pragma: no cover
+    concurrent = None
+
+BUFFER_SIZE = 1 << 20
+DEFAULT_CHUNK_SIZE = 1 << 26
+
+
+def hash_file(fh):
+    """Hash the contents of a file object.
+
+    The file is read in large buffers, so that the hash is computed
+    with as few Python-level iterations as possible.
+
+    Args:
+        fh (file): A file object opened in binary mode.
+
+    Return:
+        The digest as a byte string.
+    """
+    # type: (io.BufferedIOBase) -> bytes
+    if hasattr(hashlib, 'file_digest'):
+        return hashlib.file_digest(fh, reproducible.hash_family).digest()
+
+    hash_context = reproducible.hash_family()
+    buffer = bytearray(BUFFER_SIZE)
+    view = memoryview(buffer)
+    while True:
+        size = fh.readinto(buffer)
+        if not size:
+            break
+        hash_context.update(view[:size])
+    return hash_context.digest()
+
+
+def tree_hash_file(fh, chunk_size=DEFAULT_CHUNK_SIZE, workers=None):
+    """Hash the contents of a file object in parallel.
+
+    The file is memory-mapped and divided into chunks of ``chunk_size``
+    bytes, which are hashed on a thread pool; as the hash functions in
+    :mod:`hashlib` release the GIL, this allows hashing to use several
+    cores.  The result is the hash of the file size and the list of chunk
+    hashes, and so differs from the result of :func:`hash_file`.
+
+    Args:
+        fh          (file): A file object opened in binary mode.
+        chunk_size   (int): The number of bytes in each chunk.
+        workers      (int): The number of threads, or None for the
+            default of :class:`concurrent.futures.ThreadPoolExecutor`.
+
+    Return:
+        The digest as a byte string.
+    """
+    # type: (io.BufferedIOBase, int, int) -> bytes
+    size = os.fstat(fh.fileno()).st_size
+
+    def hash_chunk(data):
+        hash_context = reproducible.hash_family()
+        hash_context.update(b'\x00')
+        hash_context.update(data)
+        return hash_context.digest()
+
+    if size == 0:
+        chunk_hashes = []
+    else:
+        mapping = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            view = memoryview(mapping)
+            chunks = [view[start:start + chunk_size]
+                      for start in range(0, size, chunk_size)]
+            if concurrent is None or len(chunks) == 1:
+                chunk_hashes = [hash_chunk(chunk) for chunk in chunks]
+            else:
+                with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+                    chunk_hashes = list(pool.map(hash_chunk, chunks))
+            for chunk in chunks:
+                chunk.release()
+            view.release()
+        finally:
+            mapping.close()
+
+    hash_context = reproducible.hash_family()
+    hash_context.update(b'\x01')
+    hash_context.update(('%d:%d:' % (size, chunk_size)).encode('ascii'))
+    for chunk_hash in chunk_hashes:
+        hash_context.update(chunk_hash)
+    return hash_context.digest()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""Structural fingerprints of common Python values.
+
+Values built from None, booleans, numbers, strings, bytes, tuples, lists,
+dictionaries, sets, named tuples, and dataclass instances are hashed by
+walking their structure and feeding a canonical encoding into a hash
+context.  This is much faster than pickling small values, and does not
+depend on the pickle protocol or Python version.  Dictionaries and sets are
+hashed independently of their iteration order.
+
+Values of any other type found within such a structure are hashed by the
+:class:`reproducible.Data` type that :func:`reproducible.get_data_wrapper`
+chooses for them, or by their memoised cache id if they have been frozen
+with :func:`reproducible.freeze`.
+"""
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import sys
+
+import reproducible
+import reproducible.data.generic
+
+try:
+    import dataclasses
+except ImportError:  # pragma: no cover
+    dataclasses = None
+
+if sys.version_info[0] < 3:  # pragma: no cover
+    _text_type = unicode  # noqa: F821
+    _integer_types = (int, long)  # noqa: F821
+else:
+    _text_type = str
+    _integer_types = (int, )
+
+
+def _encode_length(n):
+    # type: (int) -> bytes
+    return ('%d:' % n).encode('ascii')
+
+
+def _is_namedtuple(obj):
+    # type: (object) -> bool
+    return isinstance(obj, tuple) and hasattr(type(obj), '_fields')
+
+
+def _is_dataclass_instance(obj):
+    # type: (object) -> bool
+    return dataclasses is not None and not isinstance(obj, type) and \
+        dataclasses.is_dataclass(obj)
+
+
+def _qualified_name(datatype):
+    # type: (type) -> bytes
+    return ('%s.%s' % (datatype.__module__, getattr(
+        datatype, '__qualname__', datatype.__name__))).encode('utf8')
+
+
+def is_structural(obj):
+    """Determine whether an object can be fingerprinted structurally."""
+    # type: (object) -> bool
+    return type(obj) in _ENCODERS or _is_namedtuple(obj) or \
+        _is_dataclass_instance(obj)
+
+
+def is_plain(obj):
+    """Determine whether an object is built only from structural values.
+
+    Unlike :func:`is_structural`, this is false for containers holding
+    values of any other type, which would be hashed by their cache ids, and
+    for containers that refer to themselves.
+    """
+    # type: (object) -> bool
+    return _is_plain(obj, set())
+
+
+def _is_plain(obj, active):
+    # type: (object, set) -> bool
+    if type(obj) in _ATOMIC_TYPES or type(obj) is bytearray:
+        return True
+    if not is_structural(obj) or id(obj) in active:
+        return False
+    active.add(id(obj))
+    try:
+        if isinstance(obj, dict):
+            return all(_is_plain(key, active) and _is_plain(value, active)
+                       for key, value in obj.items())
+        if _is_dataclass_instance(obj):
+            return all(_is_plain(getattr(obj, field.name), active)
+                       for field in dataclasses.fields(obj))
+        return all(_is_plain(item, active) for item in obj)
+    finally:
+        active.discard(id(obj))
+
+
+def _update_none(hash_context, obj, active):
+    hash_context.update(b'N')
+
+
+def _update_bool(hash_context, obj, active):
+    hash_context.update(b'T' if obj else b'F')
+
+
+def _update_int(hash_context, obj, active):
+    hash_context.update(('i%d;' % obj).encode('ascii'))
+
+
+def _update_float(hash_context, obj, active):
+    hash_context.update(('f%s;' % obj.hex()).encode('ascii'))
+
+
+def _update_complex(hash_context, obj, active):
+    hash_context.update(('c%s,%s;' % (obj.real.hex(), obj.imag.hex()))
+                        .encode('ascii'))
+
+
+def _update_text(hash_context, obj, active):
+    data = obj.encode('utf8', 'surrogatepass')
+    hash_context.update(b's' + _encode_length(len(data)))
+    hash_context.update(data)
+
+
+def _update_bytes(hash_context, obj, active):
+    hash_context.update(b'b' + _encode_length(len(obj)))
+    hash_context.update(obj)
+
+
+def _update_bytearray(hash_context, obj, active):
+    hash_context.update(b'B' + _encode_length(len(obj)))
+    hash_context.update(obj)
+
+
+def _update_sequence(tag):
+    def update(hash_context, obj, active):
+        hash_context.update(tag + _encode_length(len(obj)))
+        for item in obj:
+            _update(hash_context, item, active)
+    return update
+
+
+def _digest(obj, active):
+    # type: (object, set) -> bytes
+    hash_context = reproducible.hash_family()
+    _update(hash_context, obj, active)
+    return hash_context.digest()
+
+
+def _update_unordered(tag):
+    def update(hash_context, obj, active):
+        hash_context.update(tag + _encode_length(len(obj)))
+        for digest in sorted(_digest(item, active) for item in obj):
+            hash_context.update(digest)
+    return update
+
+
+def _update_dict(hash_context, obj, active):
+    hash_context.update(b'd' + _encode_length(len(obj)))
+    for digest in sorted(_digest(item, active) for item in obj.items()):
+        hash_context.update(digest)
+
+
+_ENCODERS = {
+    type(None): _update_none,
+    bool: _update_bool,
+    float: _update_float,
+    complex: _update_complex,
+    _text_type: _update_text,
+    bytes: _update_bytes,
+    bytearray: _update_bytearray,
+    tuple: _update_sequence(b't'),
+    list: _update_sequence(b'l'),
+    set: _update_unordered(b'S'),
+    frozenset: _update_unordered(b'z'),
+    dict: _update_dict,
+}
+for _integer_type in _integer_types:
+    _ENCODERS[_integer_type] = _update_int
+
+_ATOMIC_TYPES = frozenset((type(None), bool, float, complex, _text_type,
+                           bytes) + _integer_types)
+
+
+def _update(hash_context, obj, active):
+    # type: (object, object, set) -> None
+    encoder = _ENCODERS.get(type(obj))
+    if type(obj) in _ATOMIC_TYPES:
+        # Atomic values cannot be part of a cycle.
+        encoder(hash_context, obj, active)
+        return
+
+    if encoder is None and not (_is_namedtuple(obj)
+                                or _is_dataclass_instance(obj)):
+        hash_context.update(b'o')
+        hash_context.update(reproducible.data.generic.get_cache_id(obj)
+                            .encode('ascii'))
+        return
+
+    if id(obj) in active:
+        raise ValueError('Cannot fingerprint a self-referential value')
+    active.add(id(obj))
+    try:
+        if encoder is not None:
+            encoder(hash_context, obj, active)
+        elif _is_namedtuple(obj):
+            hash_context.update(b'n' + _qualified_name(type(obj)) + b';')
+            _update_sequence(b't')(hash_context, obj, active)
+        else:
+            fields = dataclasses.fields(obj)
+            hash_context.update(b'D' + _qualified_name(type(obj)) + b';' +
+                                _encode_length(len(fields)))
+            for field in fields:
+                _update_text(hash_context, field.name, active)
+                _update(hash_context, getattr(obj, field.name), active)
+    finally:
+        active.discard(id(obj))
+
+
+def update(hash_context, obj):
+    """Feed the structural fingerprint of an object into a hash context.
+
+    Args:
+        hash_context: A hash object, as returned by
+            :data:`reproducible.hash_family`.
+        obj (object): The object, for which :func:`is_structural` should
+            be true.
+
+    Raises:
+        ValueError: The object contains a reference to itself.
+    """
+    _update(hash_context, obj, set())
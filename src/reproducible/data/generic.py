@@ -6,10 +6,49 @@ from __future__ import absolute_import, division, print_function, \
 import base64
 import os.path
 import pickle
+import threading
+import weakref
+import zlib
 
 import reproducible
+from . import file_hash as file_hash_module
+from . import fingerprint
+from . import hash_index
 
 auto_type_registry = {}
+_handler_cache = {}
+
+# Protocol 5 allows large buffers, such as those of numpy arrays, to be
+# passed out-of-band so that they can be hashed without being copied.
+_HASH_PICKLE_PROTOCOL = 5 if pickle.HIGHEST_PROTOCOL >= 5 \
+    else getattr(pickle, 'DEFAULT_PROTOCOL', 0)
+
+
+class _HashingFile(object):
+    """Write-only file that feeds its input into a hash context."""
+    def __init__(self, hash_context):
+        self.hash_context = hash_context
+        self.buffer_hash_context = reproducible.hash_family()
+
+    def write(self, data):
+        self.hash_context.update(data)
+        return len(data)
+
+    def write_buffer(self, buffer):
+        """Hash an out-of-band pickle buffer in place."""
+        raw = buffer.raw()
+        self.buffer_hash_context.update(('%d:' % raw.nbytes).encode('ascii'))
+        self.buffer_hash_context.update(raw)
+        return False
+
+    def pickle(self, obj):
+        """Hash the pickled form of an object without materialising it."""
+        if _HASH_PICKLE_PROTOCOL >= 5:
+            pickle.Pickler(self, protocol=_HASH_PICKLE_PROTOCOL,
+                           buffer_callback=self.write_buffer).dump(obj)
+            self.hash_context.update(self.buffer_hash_context.digest())
+        else:
+            pickle.Pickler(self, protocol=_HASH_PICKLE_PROTOCOL).dump(obj)
 
 
 class Data(object):
@@ -72,7 +111,15 @@ class ObjectData(Data):
     def cache_id(self, _):
         hash_context = reproducible.hash_family()
         hash_context.update(type(self.obj).__name__.encode('utf8'))
-        hash_context.update(self.dumps())
+        if fingerprint.is_structural(self.obj):
+            try:
+                structural_context = hash_context.copy()
+                fingerprint.update(structural_context, self.obj)
+                hash_context = structural_context
+            except ValueError:
+                _HashingFile(hash_context).pickle(self.obj)
+        else:
+            _HashingFile(hash_context).pickle(self.obj)
         return base64.b16encode(hash_context.digest()).decode('utf8')
 
     def dump(self, fh):
@@ -91,11 +138,26 @@ class ObjectData(Data):
 
 
 class FileData(Data):
-    def __init__(self, filename):
+    """Data type for files, identified by the hash of their contents.
+
+    By default the file is hashed sequentially.  If ``tree_chunk_size`` is
+    set, files larger than one chunk are instead hashed in parallel with
+    :func:`reproducible.data.file_hash.tree_hash_file`, using
+    ``tree_workers`` threads; this gives different cache ids.  Both can be
+    set on the class to change the default for all files.
+    """
+    tree_chunk_size = None
+    tree_workers = None
+
+    def __init__(self, filename, tree_chunk_size=None, tree_workers=None):
         super(FileData, self).__init__()
         self.filename = filename
         self.id_cached = None
         self.id_cached_modification_time = None
+        if tree_chunk_size is not None:
+            self.tree_chunk_size = tree_chunk_size
+        if tree_workers is not None:
+            self.tree_workers = tree_workers
 
     @property
     def value(self):
@@ -105,14 +167,26 @@ class FileData(Data):
         modification_time = os.path.getmtime(self.filename)
         if (not self.id_cached
                 or modification_time > self.id_cached_modification_time):
-            with open(self.filename, 'rb') as fh:
-                hash_context = reproducible.hash_family()
-                for chunk in iter(lambda: fh.read(1024), b''):
-                    hash_context.update(chunk)
-                file_hash = hash_context.digest()
-                self.id_cached = base64.b16encode(file_hash).decode(
-                    'ascii').lower()
-                self.id_cached_modification_time = modification_time
+            index = hash_index.get_file_hash_index()
+            key, stat_modification_time = hash_index.stat_key(self.filename)
+            tree = self.tree_chunk_size is not None \
+                and key[3] > self.tree_chunk_size
+            algorithm = reproducible.hash_family().name
+            if tree:
+                algorithm += '-tree-%d' % self.tree_chunk_size
+            file_hash = index.lookup(key, algorithm)
+            if file_hash is None:
+                with open(self.filename, 'rb') as fh:
+                    if tree:
+                        digest = file_hash_module.tree_hash_file(
+                            fh, self.tree_chunk_size, self.tree_workers)
+                    else:
+                        digest = file_hash_module.hash_file(fh)
+                file_hash = base64.b16encode(digest).decode('ascii').lower()
+                index.store(key, stat_modification_time, file_hash,
+                            algorithm)
+            self.id_cached = file_hash
+            self.id_cached_modification_time = modification_time
 
         return self.id_cached
 
@@ -131,14 +205,214 @@ class FileData(Data):
         return FileData(s.decode('utf8'))
 
 
-def get_data_wrapper(obj):
-    """Automatically select the right reproducible.Data type for an object."""
+class LazyData(Data):
+    """Proxy for a cached result that is loaded only when it is used.
+
+    Functions decorated with ``@operation(lazy=True)`` return these.  The
+    cache id of a proxy is the cache key of the result, so passing it to
+    another operation neither loads nor hashes the result itself.  The
+    result is loaded once, even when it is used from several threads.
+
+    Args:
+        cache_key (str): The cache key of the result.
+        load (function): Called with no arguments to obtain the result.
+    """
+    _NOT_LOADED = object()
+
+    def __init__(self, cache_key, load):
+        # type: (str, object) -> None
+        super(LazyData, self).__init__()
+        self.cache_key = cache_key
+        self.__load = load
+        self.__value = self._NOT_LOADED
+        self.__lock = threading.Lock()
+
+    @classmethod
+    def loaded(cls, cache_key, value):
+        """Make a proxy for a result that is already in memory."""
+        # type: (str, object) -> LazyData
+        data = cls(cache_key, None)
+        data.__value = value
+        return data
+
+    @property
+    def is_loaded(self):
+        # type: () -> bool
+        return self.__value is not self._NOT_LOADED
+
+    @property
+    def value(self):
+        if self.__value is self._NOT_LOADED:
+            with self.__lock:
+                # Another thread may have loaded it while we waited.
+                if self.__value is self._NOT_LOADED:
+                    self.__value = self.__load()
+                    self.__load = None
+        return self.__value
+
+    def cache_id(self, _):
+        return self.cache_key
+
+    def __repr__(self):
+        return 'LazyData(%r)' % self.cache_key
+
+
+def _resolve_handler(datatype):
+    # type: (type) -> type
+    for base in getattr(datatype, '__mro__', (datatype, )):
+        if base in auto_type_registry:
+            return auto_type_registry[base]
+    # Abstract base classes may have virtual subclasses outside the MRO.
     for key in auto_type_registry:
-        if isinstance(obj, key):
-            return auto_type_registry[key](obj)
-    return ObjectData(obj)
+        if issubclass(datatype, key):
+            return auto_type_registry[key]
+    return ObjectData
+
+
+class _FrozenEntry(object):
+    """Memoised cache id of a frozen object."""
+    def __init__(self, obj):
+        try:
+            self.ref = weakref.ref(obj, self.__forget)
+        except TypeError:
+            # Some objects, such as lists and tuples, cannot be weakly
+            # referenced; holding a strong reference ensures that their id
+            # is not reused.
+            self.strong_ref = obj
+            self.ref = lambda: self.strong_ref
+        self.key = id(obj)
+        self.cache_id = None
+        self.checksum = None
+
+    def __forget(self, _):
+        if _frozen.get(self.key) is self:
+            del _frozen[self.key]
+
+    def valid_for(self, obj):
+        # type: (object) -> bool
+        if self.ref() is not obj:
+            return False
+        # A read-only view may still be modified through its base.
+        while obj is not None:
+            flags = getattr(obj, 'flags', None)
+            if flags is not None and getattr(flags, 'writeable', False):
+                return False
+            obj = getattr(obj, 'base', None)
+        return True
+
+
+def _memory_checksum(obj):
+    """Checksum the memory of an array that could be written to again.
+
+    Numpy lets an array that owns its memory be made writeable again at
+    any time, so a memoised cache id is checked against the checksum of
+    its memory, which is much cheaper to compute than the cache id.
+
+    Return:
+        The checksum, or None if the object is not an array or its memory
+        belongs to a read-only buffer, such as a read-only memory map.
+    """
+    # type: (object) -> int
+    if getattr(obj, 'flags', None) is None:
+        return None
+    owner = obj
+    while getattr(owner, 'base', None) is not None:
+        owner = owner.base
+    if getattr(owner, 'flags', None) is None:
+        try:
+            if memoryview(owner).readonly:
+                return None
+        except TypeError:
+            pass
+    if not obj.flags.c_contiguous:
+        obj = obj.copy()
+    return zlib.crc32(obj) & 0xffffffff
+
+
+_frozen = {}
+
+
+def freeze(obj):
+    """Promise that an object will not be modified.
+
+    The cache id of a frozen object is computed the first time it is
+    needed and then remembered, so that passing the same large object to
+    many :func:`@reproducible.operation <reproducible.operation>` calls
+    does not require it to be hashed every time.  Numpy arrays are made
+    read-only, and their memoised cache id is not used while they, or the
+    arrays of which they are views, are writeable.  As numpy allows arrays
+    to be made writeable again, the memoised cache id of an array is
+    checked against a checksum of its memory, which is much cheaper than
+    hashing it, unless the memory belongs to a read-only buffer.  For other
+    objects, modifying them after freezing them will cause incorrect
+    results to be returned from the cache.
+
+    Objects that cannot be weakly referenced, such as lists and
+    dictionaries, are kept alive until :func:`unfreeze` is called.
+
+    Args:
+        obj (object): The object to be frozen.
+
+    Return:
+        obj itself.
+    """
+    flags = getattr(obj, 'flags', None)
+    if flags is not None and hasattr(flags, 'writeable'):
+        flags.writeable = False
+    entry = _frozen.get(id(obj))
+    if entry is None or not entry.valid_for(obj):
+        _frozen[id(obj)] = _FrozenEntry(obj)
+    return obj
+
+
+def unfreeze(obj):
+    """Forget the memoised cache id of an object frozen with `freeze`."""
+    entry = _frozen.get(id(obj))
+    if entry is not None and entry.ref() is obj:
+        del _frozen[id(obj)]
+
+
+def get_cache_id(obj):
+    """Compute the cache id of an object, which may be a `Data` instance.
+
+    The cache ids of objects marked with :func:`freeze` are memoised.
+    """
+    # type: (object) -> str
+    if isinstance(obj, Data):
+        return obj.cache_id(None)
+    entry = _frozen.get(id(obj))
+    if entry is None:
+        return get_data_wrapper(obj).cache_id(None)
+    if not entry.valid_for(obj):
+        if entry.ref() is obj:
+            # The object may be modified while it is writeable.
+            entry.cache_id = None
+        return get_data_wrapper(obj).cache_id(None)
+    if entry.cache_id is not None and entry.checksum is not None and \
+            _memory_checksum(obj) != entry.checksum:
+        # Modified while it was briefly made writeable.
+        entry.cache_id = None
+    if entry.cache_id is None:
+        entry.checksum = _memory_checksum(obj)
+        entry.cache_id = get_data_wrapper(obj).cache_id(None)
+    return entry.cache_id
+
+
+def get_data_wrapper(obj):
+    """Automatically select the right reproducible.Data type for an object.
+
+    The handler registered for the most specific class in the object's
+    method resolution order is used, and the choice is cached for each
+    type.
+    """
+    datatype = type(obj)
+    handler = _handler_cache.get(datatype)
+    if handler is None:
+        handler = _handler_cache[datatype] = _resolve_handler(datatype)
+    return handler(obj)
 
 
 def register_type(datatype, handler):
     """Register a type in the auto-wrapper."""
     auto_type_registry[datatype] = handler
+    _handler_cache.clear()
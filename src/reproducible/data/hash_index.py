@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import os
+import os.path
+import sqlite3
+import threading
+import time
+
+import reproducible
+
+# Files modified more recently than this many seconds ago are not added
+# to the index, as a further modification within the resolution of the
+# filesystem timestamps would not be detected.
+RACY_INTERVAL = 2.0
+
+
+def default_index_path():
+    # type: () -> str
+    """Location of the on-disk file hash index.
+
+    This is given by the ``REPRODUCIBLE_FILE_HASH_INDEX`` environment
+    variable if it is set, and otherwise lies within ``$XDG_CACHE_HOME``.
+    """
+    path = os.environ.get('REPRODUCIBLE_FILE_HASH_INDEX')
+    if path is not None:
+        return path
+    cache_home = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'reproducible', 'file_hashes.sqlite3')
+
+
+def stat_key(filename):
+    # type: (str) -> tuple
+    """Identify the current version of a file by its metadata.
+
+    Return:
+        A tuple of (absolute path, device, inode, size, mtime_ns), and the
+        modification time in seconds.
+    """
+    st = os.stat(filename)
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:  # pragma: no cover
+        mtime_ns = int(st.st_mtime * 1e9)
+    return ((os.path.abspath(filename), st.st_dev, st.st_ino, st.st_size,
+             mtime_ns), st.st_mtime)
+
+
+class FileHashIndex(object):
+    """Index of file content hashes keyed on file metadata.
+
+    The index maps the absolute path, device, inode, size, and modification
+    time of a file to the hash of its contents, so that unchanged files
+    need not be read again.  Entries are kept in memory for the lifetime
+    of the process and, if a path is given, in an SQLite database shared
+    between runs.
+    """
+    def __init__(self, path=None):
+        """
+        Args:
+            path (str): The location of the on-disk index, or None to keep
+                the index in memory only.
+        """
+        # type: (str) -> None
+        self.path = path
+        self.memory = {}
+        self.lock = threading.Lock()
+        self.connection = None
+        self.connection_pid = None
+
+    def __connect(self):
+        # type: () -> sqlite3.Connection
+        if self.path is None:
+            return None
+        if self.connection is not None and \
+                self.connection_pid == os.getpid():
+            return self.connection
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            connection = sqlite3.connect(self.path, timeout=30,
+                                         check_same_thread=False)
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS file_hashes ('
+                ' path TEXT PRIMARY KEY, device INTEGER, inode INTEGER,'
+                ' size INTEGER, mtime_ns INTEGER, algorithm TEXT,'
+                ' digest TEXT)')
+            connection.commit()
+        except (OSError, sqlite3.Error):
+            # An unusable index only costs us the time to rehash.
+            self.path = None
+            return None
+        self.connection = connection
+        self.connection_pid = os.getpid()
+        return connection
+
+    def lookup(self, key, algorithm=None):
+        # type: (tuple, str) -> str
+        """Find the hash of a file, or None if it is not in the index.
+
+        Args:
+            key       (tuple): The file's metadata, from :func:`stat_key`.
+            algorithm   (str): The name of the hash algorithm, by default
+                that of :data:`reproducible.hash_family`.
+        """
+        if algorithm is None:
+            algorithm = reproducible.hash_family().name
+        digest = self.memory.get((key, algorithm))
+        if digest is not None:
+            return digest
+        with self.lock:
+            connection = self.__connect()
+            if connection is None:
+                return None
+            try:
+                row = connection.execute(
+                    'SELECT device, inode, size, mtime_ns, algorithm, digest'
+                    ' FROM file_hashes WHERE path = ?', (key[0], )).fetchone()
+            except sqlite3.Error:
+                return None
+        if row is None or tuple(row[:4]) != key[1:] or row[4] != algorithm:
+            return None
+        self.memory[(key, algorithm)] = row[5]
+        return row[5]
+
+    def store(self, key, modification_time, digest, algorithm=None):
+        # type: (tuple, float, str, str) -> None
+        """Record the hash of a file."""
+        if modification_time > time.time() - RACY_INTERVAL:
+            return
+        if algorithm is None:
+            algorithm = reproducible.hash_family().name
+        self.memory[(key, algorithm)] = digest
+        with self.lock:
+            connection = self.__connect()
+            if connection is None:
+                return
+            try:
+                with connection:
+                    connection.execute(
+                        'INSERT OR REPLACE INTO file_hashes VALUES'
+                        ' (?, ?, ?, ?, ?, ?, ?)', key + (algorithm, digest))
+            except sqlite3.Error:
+                pass
+
+
+def set_file_hash_index(index):
+    """Set the global file hash index.
+
+    Args:
+        index (reproducible.FileHashIndex): The new index.
+
+    Return:
+        Nothing.
+    """
+    # type: (FileHashIndex) -> None
+    global _index
+    _index = index
+
+
+def get_file_hash_index():
+    # type: () -> FileHashIndex
+    global _index
+    return _index
+
+
+_index = FileHashIndex(default_index_path())
@@ -6,12 +6,36 @@ from __future__ import absolute_import, division, print_function, \
 import base64
 import io
 import json
+import struct
+
 import keras.models
 import numpy
+
 import reproducible
+from .generic import Data, register_type
+from .numpy import ArrayData, update_hash
+
+
+class ModelData(Data):
+    """Data type for :class:`keras.models.Model` objects.
+
+    Models are stored in a binary container: a fixed header, the model
+    architecture as JSON, and then each weight tensor in the ``.npy``
+    format.  Every tensor starts at a multiple of ``ALIGNMENT`` bytes from
+    the start of the container, so that when loaded from a real file the
+    weights are memory-mapped rather than read and copied.
+
+    Models stored in the older format, a JSON document holding the
+    architecture and base64-encoded weights, can still be loaded.
 
+    The cache id is computed from the architecture and the weight buffers
+    themselves, without serialising the model.
+    """
+    MAGIC = b'RPKM'
+    VERSION = 1
+    HEADER = struct.Struct('<4sBxxxQQ')
+    ALIGNMENT = 64
 
-class ModelData(reproducible.generic.Data):
     def __init__(self, model):
         # type: (keras.models.Model) -> None
         super(ModelData, self).__init__()
@@ -21,20 +45,32 @@ class ModelData(reproducible.generic.Data):
     def value(self):
         return self.model
 
-    def dumps(self):
-        weights = []
-        for weight in self.model.get_weights():
-            sio = io.BytesIO()
-            numpy.save(sio, weight)
-            weights.append(base64.b64encode(sio.getvalue()).decode('ascii'))
-            sio.close()
-        return json.dumps({
-            'weights': weights,
-            'architecture': self.model.to_json()
-        }).encode('utf8')
+    @classmethod
+    def __padding(cls, position):
+        # type: (int) -> int
+        return -position % cls.ALIGNMENT
 
     def dump(self, fh):
-        fh.write(self.dumps())
+        architecture = self.model.to_json().encode('utf8')
+        weights = self.model.get_weights()
+        header = self.HEADER.pack(self.MAGIC, self.VERSION,
+                                  len(architecture), len(weights))
+
+        fh.write(header)
+        fh.write(architecture)
+        position = len(header) + len(architecture)
+        for weight in weights:
+            padding = self.__padding(position)
+            fh.write(b'\0' * padding)
+            sio = io.BytesIO()
+            ArrayData(weight).dump(sio)
+            fh.write(sio.getbuffer())
+            position += padding + sio.tell()
+
+    def dumps(self):
+        sio = io.BytesIO()
+        self.dump(sio)
+        return sio.getvalue()
 
     @classmethod
     def __from_dict(cls, parsed_data):
@@ -49,17 +85,41 @@ class ModelData(reproducible.generic.Data):
 
     @classmethod
     def load(cls, fh):
-        return cls.__from_dict(json.load(fh))
+        prefix = fh.read(cls.HEADER.size)
+        if not prefix.startswith(cls.MAGIC):
+            # The original format is a single JSON document.
+            return cls.__from_dict(json.loads((prefix + fh.read())
+                                              .decode('utf8')))
+
+        _, version, architecture_length, weight_count = \
+            cls.HEADER.unpack(prefix)
+        if version != cls.VERSION:
+            raise IOError('Unsupported model format version %d' % version)
+        architecture = fh.read(architecture_length)
+        position = len(prefix) + len(architecture)
+        weights = []
+        for _ in range(weight_count):
+            padding = cls.__padding(position)
+            fh.read(padding)
+            start = fh.tell()
+            weights.append(ArrayData.load(fh).value)
+            position += padding + fh.tell() - start
+
+        model = keras.models.model_from_json(architecture.decode('utf8'))
+        model.set_weights(weights)
+        return ModelData(model)
 
     @classmethod
     def loads(cls, s):
-        return cls.__from_dict(json.loads(s.decode('utf8')))
+        return cls.load(io.BytesIO(s))
 
     def cache_id(self, _):
         hash_context = reproducible.hash_family()
         hash_context.update(type(self.model).__name__.encode('utf8'))
-        hash_context.update(self.dumps())
+        hash_context.update(self.model.to_json().encode('utf8'))
+        for weight in self.model.get_weights():
+            update_hash(hash_context, weight)
         return base64.b16encode(hash_context.digest()).decode('ascii').lower()
 
 
-reproducible.register_type(keras.models.Model, ModelData)
+register_type(keras.models.Model, ModelData)
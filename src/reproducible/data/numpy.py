@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import base64
+import io
+import pickle
+
+import numpy
+import numpy.lib.format
+
+import reproducible
+from .generic import Data, ObjectData, register_type
+
+# Subclasses of ndarray, such as masked arrays and matrices, carry state
+# that the .npy format does not hold, and so are pickled instead.  Arrays
+# loaded from the cache are memory-mapped, and must be hashed like the
+# arrays that they replace.
+_PLAIN_ARRAY_TYPES = (numpy.ndarray, numpy.memmap)
+
+
+def update_hash(hash_context, array):
+    """Feed the dtype, shape, and contents of an array into a hash context.
+
+    The array buffer is hashed directly unless the array holds objects,
+    in which case it is pickled.
+    """
+    # type: (object, numpy.ndarray) -> None
+    if array.dtype.hasobject:
+        hash_context.update(pickle.dumps(array))
+    else:
+        array = numpy.ascontiguousarray(array)
+        # The type string of a structured dtype gives only its size.
+        dtype = array.dtype.str if array.dtype.names is None \
+            else repr(array.dtype.descr)
+        hash_context.update(dtype.encode('utf8'))
+        hash_context.update(repr(array.shape).encode('utf8'))
+        hash_context.update(array.reshape(-1).view(numpy.uint8))
+
+
+class ArrayData(Data):
+    """Data type for :class:`numpy.ndarray` objects.
+
+    Arrays are stored in the ``.npy`` format, whose header is padded so
+    that the array data itself is aligned.  When loaded from a real file,
+    the array is memory-mapped read-only rather than read into memory, so
+    that a cache hit costs nothing until the array is actually used.
+
+    The cache id is computed directly from the dtype, shape, and array
+    buffer, without pickling the array.
+    """
+    def __init__(self, array):
+        # type: (numpy.ndarray) -> None
+        super(ArrayData, self).__init__()
+        self.array = array
+
+    @property
+    def value(self):
+        return self.array
+
+    def cache_id(self, _):
+        hash_context = reproducible.hash_family()
+        hash_context.update(numpy.ndarray.__name__.encode('utf8'))
+        update_hash(hash_context, self.array)
+        return base64.b16encode(hash_context.digest()).decode('utf8')
+
+    def dump(self, fh):
+        numpy.lib.format.write_array(fh, self.array,
+                                     allow_pickle=self.array.dtype.hasobject)
+
+    def dumps(self):
+        sio = io.BytesIO()
+        self.dump(sio)
+        return sio.getvalue()
+
+    @classmethod
+    def __mmap(cls, fh):
+        # type: (io.IOBase) -> numpy.ndarray
+        try:
+            fh.fileno()
+        except (AttributeError, io.UnsupportedOperation, ValueError):
+            return None
+
+        start = fh.tell()
+        version = numpy.lib.format.read_magic(fh)
+        if version == (1, 0):
+            header = numpy.lib.format.read_array_header_1_0(fh)
+        elif version == (2, 0):
+            header = numpy.lib.format.read_array_header_2_0(fh)
+        else:
+            fh.seek(start)
+            return None
+
+        shape, fortran_order, dtype = header
+        if dtype.hasobject or numpy.prod(shape) == 0:
+            fh.seek(start)
+            return None
+
+        offset = fh.tell()
+        array = numpy.memmap(fh, dtype=dtype, mode='r', shape=shape,
+                             order='F' if fortran_order else 'C',
+                             offset=offset)
+        # numpy.memmap leaves the file positioned at its end.
+        fh.seek(offset + array.nbytes)
+        return array
+
+    @classmethod
+    def load(cls, fh):
+        array = cls.__mmap(fh)
+        if array is None:
+            array = numpy.lib.format.read_array(fh, allow_pickle=True)
+        return ArrayData(array)
+
+    @classmethod
+    def loads(cls, s):
+        return cls.load(io.BytesIO(s))
+
+
+def _wrap_array(array):
+    # type: (numpy.ndarray) -> Data
+    if type(array) in _PLAIN_ARRAY_TYPES:
+        return ArrayData(array)
+    return ObjectData(array)
+
+
+register_type(numpy.ndarray, _wrap_array)
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""Discovery of the user code on which a function depends.
+
+The names used by a function's bytecode are looked up in its module's
+globals.  Functions and classes defined in user modules, that is modules
+outside the standard library, installed packages, and :mod:`reproducible`
+itself, are followed transitively, and module-level constants built only
+from simple values are included by value.  Functions and classes reached
+through a user module, as in ``helpers.smooth(x)``, are followed too.
+
+The digest of each function or class is memoised, and recomputed only when
+the modification time of its file changes.  Code without a file, such as
+that of notebook cells, is analysed again whenever one of the global names
+that it uses has been rebound.
+"""
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import base64
+import inspect
+import os
+import sys
+import sysconfig
+import types
+import weakref
+
+import reproducible
+from .data import fingerprint
+
+_memo = weakref.WeakKeyDictionary()
+_user_modules = {}
+
+
+def modification_time(filename):
+    # type: (str) -> float
+    """Get the modification time of a file, or None if it does not exist."""
+    try:
+        return os.stat(filename).st_mtime
+    except (IOError, OSError, TypeError):
+        # Interactive sessions have no backing file; their source
+        # cannot change without redefining the function.
+        return None
+
+
+def _library_paths():
+    # type: () -> tuple
+    paths = sysconfig.get_paths()
+    directories = [paths.get(name) for name in
+                   ('stdlib', 'platstdlib', 'purelib', 'platlib')]
+    directories.append(os.path.dirname(reproducible.__file__))
+    return tuple(os.path.join(os.path.realpath(directory), '')
+                 for directory in directories if directory)
+
+
+_LIBRARY_PATHS = _library_paths()
+
+
+def is_user_module(name):
+    """Determine whether a module holds user code to be followed."""
+    # type: (str) -> bool
+    result = _user_modules.get(name)
+    if result is None:
+        module = sys.modules.get(name)
+        filename = getattr(module, '__file__', None)
+        if filename is None:
+            result = name == '__main__'
+        else:
+            result = not os.path.realpath(filename).startswith(
+                _LIBRARY_PATHS)
+        _user_modules[name] = result
+    return result
+
+
+def _unwrap(obj):
+    # type: (object) -> object
+    # Follow decorators, including reproducible.operation, to the
+    # function that they wrap.
+    while isinstance(obj, types.FunctionType) and \
+            hasattr(obj, '__wrapped__'):
+        obj = obj.__wrapped__
+    return obj
+
+
+def _is_followed(obj):
+    # type: (object) -> bool
+    return isinstance(obj, (types.FunctionType, type)) and \
+        is_user_module(getattr(obj, '__module__', None))
+
+
+def _code_names(code, names):
+    # type: (types.CodeType, set) -> None
+    names.update(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _code_names(const, names)
+
+
+def _functions(obj):
+    # type: (object) -> list
+    if isinstance(obj, types.FunctionType):
+        return [obj]
+    functions = []
+    for value in vars(obj).values():
+        value = getattr(value, '__func__', value)
+        if isinstance(value, property):
+            functions.extend(f for f in (value.fget, value.fset, value.fdel)
+                             if f is not None)
+        elif isinstance(value, types.FunctionType):
+            functions.append(value)
+    return functions
+
+
+def _hexdigest(hash_context):
+    return base64.b16encode(hash_context.digest()).decode('ascii')
+
+
+def _own_digest(obj):
+    # type: (object) -> str
+    hash_context = reproducible.hash_family()
+    try:
+        hash_context.update(inspect.getsource(obj).encode('utf8'))
+    except (IOError, OSError, TypeError):
+        for function in _functions(obj):
+            hash_context.update(function.__code__.co_code)
+            hash_context.update(repr(function.__code__.co_consts)
+                                .encode('utf8'))
+    return _hexdigest(hash_context)
+
+
+def _analyse(obj):
+    # type: (object) -> tuple
+    """Hash an object's code and find the objects that it refers to.
+
+    Two digests are returned: that of the object's source alone, and that
+    also including the values of the module-level constants that it uses.
+    These are followed by the objects that it refers to, and the bindings
+    of global names through which they were found, as (namespace, name,
+    value) tuples.
+    """
+    names = set()
+    values = []
+    namespace = vars(sys.modules[obj.__module__]) \
+        if obj.__module__ in sys.modules else {}
+    for function in _functions(obj):
+        _code_names(function.__code__, names)
+        namespace = function.__globals__
+        for cell in function.__closure__ or ():
+            try:
+                values.append(cell.cell_contents)
+            except ValueError:
+                # An empty cell.
+                pass
+
+    references = []
+    constants = []
+    bindings = []
+    for name in sorted(names):
+        if name not in namespace:
+            continue
+        value = namespace[name]
+        bindings.append((namespace, name, value))
+        if isinstance(value, types.ModuleType):
+            if is_user_module(value.__name__):
+                module_namespace = vars(value)
+                for attribute in sorted(names):
+                    if attribute in module_namespace:
+                        bindings.append((module_namespace, attribute,
+                                         module_namespace[attribute]))
+                        values.append(module_namespace[attribute])
+        elif fingerprint.is_plain(value):
+            # Module-level constants are part of the code's behaviour.
+            # Containers of other objects, such as locks or connections,
+            # are not constants, and may not even be hashable.
+            constant_context = reproducible.hash_family()
+            try:
+                fingerprint.update(constant_context, value)
+            except Exception:
+                continue
+            constants.append('%s=%s;' % (name, _hexdigest(constant_context)))
+        else:
+            values.append(value)
+
+    for value in values:
+        value = _unwrap(value)
+        if _is_followed(value) and value is not obj \
+                and value not in references:
+            references.append(value)
+
+    source_digest = digest = _own_digest(obj)
+    if constants:
+        hash_context = reproducible.hash_family()
+        hash_context.update(digest.encode('ascii'))
+        hash_context.update(''.join(constants).encode('utf8'))
+        digest = _hexdigest(hash_context)
+    return source_digest, digest, references, bindings
+
+
+def _is_bound(bindings):
+    # type: (list) -> bool
+    return all(namespace.get(name, bindings) is value
+               for namespace, name, value in bindings)
+
+
+def _lookup(obj):
+    # type: (object) -> tuple
+    filename = inspect.getsourcefile(obj) if not isinstance(obj, type) \
+        else getattr(sys.modules.get(obj.__module__), '__file__', None)
+    mtime = modification_time(filename)
+    entry = _memo.get(obj)
+    if entry is None or entry[0] != (filename, mtime) or \
+            (mtime is None and not _is_bound(entry[4])):
+        # Without a file to watch, the names that the code uses may have
+        # been redefined, as when a notebook cell is run again.
+        entry = ((filename, mtime), ) + _analyse(obj)
+        _memo[obj] = entry
+    return entry
+
+
+def source_digest(obj):
+    """Get the hexadecimal digest of the source of a function or class."""
+    # type: (object) -> str
+    return _lookup(obj)[1]
+
+
+def dependencies(func):
+    """Find the user code on which a function depends, transitively.
+
+    Args:
+        func (function): The function.
+
+    Return:
+        A tuple of a sorted list of (qualified name, digest) pairs, one for
+        each function or class reached from the function, including itself;
+        and a dictionary mapping each file involved to its modification
+        time, which is None for code without a file.  Each digest covers
+        the module-level constants that its function or class uses.
+    """
+    # type: (types.FunctionType) -> tuple
+    entries = []
+    files = {}
+    seen = set()
+    stack = [func]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        (filename, mtime), _, digest, references, _ = _lookup(obj)
+        files[filename] = mtime
+        entries.append(('%s.%s' % (obj.__module__, getattr(
+            obj, '__qualname__', obj.__name__)), digest))
+        stack.extend(references)
+    return sorted(entries), files
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""Deferred execution of graphs of cached operations.
+
+Calls to functions decorated with :func:`reproducible.operation` are
+recorded as nodes of a :class:`Graph` rather than made immediately.  Each
+node is identified by the cache key of its call, computed with the cache
+keys of any nodes among its arguments in place of their values, so that
+identical calls become a single node and the graph can tell which results
+are cached before computing anything.
+"""
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import collections
+import inspect
+
+try:
+    import concurrent.futures
+except ImportError:  # pragma: no cover
+    concurrent = None
+
+import reproducible
+from . import instrumentation
+from .wrapper import _value
+
+
+class Node(reproducible.LazyData):
+    """A deferred call to an operation.
+
+    A node may be passed as an argument to further calls recorded in the
+    same graph.  Its value is computed, or loaded from the cache, when it
+    is first used.
+
+    Attributes:
+        cache_key     (str): The cache key of the call.
+        dependencies (list): The nodes among the arguments of the call.
+        state         (str): 'cached' if the last run found the result in
+            the cache, 'computed' if it computed it, or None.
+        duration    (float): The time in seconds taken to compute the
+            result in the last run, or None.
+    """
+    def __init__(self, key, operation, args, kwargs):
+        # type: (str, object, tuple, dict) -> None
+        super(Node, self).__init__(key, self.__evaluate)
+        self.operation = operation
+        self.args = args
+        self.kwargs = kwargs
+        self.dependencies = []
+        for arg in list(args) + list(kwargs.values()):
+            if isinstance(arg, Node) and arg not in self.dependencies:
+                self.dependencies.append(arg)
+        self.state = None
+        self.duration = None
+
+    def __evaluate(self):
+        # type: () -> object
+        result = self.operation(*self.args, **self.kwargs)
+        if concurrent is not None and \
+                isinstance(result, concurrent.futures.Future):
+            result = result.result()
+        return _value(result)
+
+    def __repr__(self):
+        return 'Node(%r)' % self.cache_key
+
+
+class Graph(object):
+    """A graph of deferred calls to cached operations.
+
+    Calls are recorded with :meth:`add`, which returns a :class:`Node`
+    that may be passed to further calls.  :meth:`run` then computes the
+    results that are not already cached, in topological order and with
+    the requested parallelism, skipping everything upstream of a cached
+    result.
+
+    Example:
+        >>> graph = reproducible.Graph()
+        >>> data = graph.add(load, 'data.csv')
+        >>> model = graph.add(fit, data, degree=3)
+        >>> figure = graph.add(plot, data, model)
+        >>> graph.run(workers=4)
+        >>> figure.value
+    """
+    def __init__(self):
+        self.nodes = collections.OrderedDict()
+
+    def add(self, operation, *args, **kwargs):
+        """Record a call to an operation.
+
+        Args:
+            operation (function): A function decorated with
+                :func:`reproducible.operation`.
+            *args: The positional arguments of the call.
+            **kwargs: The keyword arguments of the call.
+
+        Return:
+            The :class:`Node` for the call, which is shared with any
+            identical call already recorded.
+        """
+        # type: (object, ...) -> Node
+        if not hasattr(operation, 'cache_key') or \
+                inspect.iscoroutinefunction(operation):
+            raise TypeError('%r is not a synchronous cached operation'
+                            % (operation, ))
+        key = operation.cache_key(*args, **kwargs)
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = Node(key, operation, args, kwargs)
+        return node
+
+    def __needed(self, targets):
+        # type: (list) -> collections.OrderedDict
+        cache = reproducible.get_cache()
+        needed = collections.OrderedDict()
+        seen = set()
+        stack = list(targets)
+        while stack:
+            node = stack.pop()
+            if node.cache_key in seen:
+                continue
+            seen.add(node.cache_key)
+            if node.is_loaded:
+                continue
+            if cache.is_cached(node.cache_key):
+                node.state = 'cached'
+                continue
+            needed[node.cache_key] = node
+            stack.extend(node.dependencies)
+        return needed
+
+    @staticmethod
+    def __compute(node):
+        # type: (Node) -> None
+        start = instrumentation.clock()
+        node.value  # Computes the result, loading its arguments.
+        node.duration = instrumentation.clock() - start
+        node.state = 'computed'
+
+    def run(self, targets=None, workers=1):
+        """Compute the results that are not already cached.
+
+        Args:
+            targets  (list): The nodes whose results are wanted, or None
+                for those on which no other node depends.
+            workers   (int): The number of calls to make at once.  Calls
+                are made on threads; for parallelism in CPU-bound Python
+                code, give the operations a process pool executor.
+        """
+        # type: (list, int) -> None
+        for node in self.nodes.values():
+            node.state = None
+            node.duration = None
+        if targets is None:
+            used = set(dependency.cache_key for node in self.nodes.values()
+                       for dependency in node.dependencies)
+            targets = [node for node in self.nodes.values()
+                       if node.cache_key not in used]
+        needed = self.__needed(targets)
+
+        remaining = dict((key, sum(dependency.cache_key in needed
+                                   for dependency in node.dependencies))
+                         for key, node in needed.items())
+        dependents = collections.defaultdict(list)
+        for node in needed.values():
+            for dependency in node.dependencies:
+                if dependency.cache_key in needed:
+                    dependents[dependency.cache_key].append(node)
+        ready = collections.deque(node for node in needed.values()
+                                  if remaining[node.cache_key] == 0)
+
+        if concurrent is None or workers <= 1:
+            while ready:
+                node = ready.popleft()
+                self.__compute(node)
+                for dependent in dependents[node.cache_key]:
+                    remaining[dependent.cache_key] -= 1
+                    if remaining[dependent.cache_key] == 0:
+                        ready.append(dependent)
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            running = dict((pool.submit(self.__compute, node), node)
+                           for node in ready)
+            while running:
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    node = running.pop(future)
+                    if future.exception() is not None:
+                        # Leaving the pool waits for the calls already made.
+                        raise future.exception()
+                    for dependent in dependents[node.cache_key]:
+                        remaining[dependent.cache_key] -= 1
+                        if remaining[dependent.cache_key] == 0:
+                            running[pool.submit(self.__compute,
+                                                dependent)] = dependent
+
+    def critical_path(self):
+        """Find the longest chain of computations in the last run.
+
+        Return:
+            A tuple of the total time in seconds taken by the chain, and a
+            list of its nodes in the order in which they were computed.
+        """
+        # type: () -> tuple
+        finish = {}
+        previous = {}
+        for node in self.__topological_order():
+            if node.duration is None:
+                continue
+            start = 0.0
+            for dependency in node.dependencies:
+                if finish.get(dependency.cache_key, 0.0) > start:
+                    start = finish[dependency.cache_key]
+                    previous[node.cache_key] = dependency
+            finish[node.cache_key] = start + node.duration
+
+        if not finish:
+            return 0.0, []
+        key = max(finish, key=finish.get)
+        path = [self.nodes[key]]
+        while path[-1].cache_key in previous:
+            path.append(previous[path[-1].cache_key])
+        return finish[key], path[::-1]
+
+    def __topological_order(self):
+        # type: () -> list
+        order = []
+        visited = set()
+        for root in self.nodes.values():
+            stack = [(root, False)]
+            while stack:
+                node, expanded = stack.pop()
+                if expanded:
+                    order.append(node)
+                    continue
+                if node.cache_key in visited:
+                    continue
+                visited.add(node.cache_key)
+                stack.append((node, True))
+                stack.extend((dependency, False)
+                             for dependency in node.dependencies)
+        return order
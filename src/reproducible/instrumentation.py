@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""Statistics on cache performance.
+
+When enabled with :func:`enable_stats`, every function decorated with
+:func:`reproducible.operation` records how often it hits and misses the
+cache, and how long it spends on each stage of a call.  Recording is
+disabled by default, in which case it costs a single flag check per call.
+"""
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import json
+import threading
+import time
+
+clock = getattr(time, 'perf_counter', time.time)
+
+#: Whether statistics are being recorded.
+enabled = False
+
+_lock = threading.Lock()
+_records = {}
+_current = threading.local()
+
+
+class OperationStats(object):
+    """Statistics for a single decorated function.
+
+    Attributes:
+        hits             (int): The number of calls answered from the cache.
+        misses           (int): The number of calls that were computed.
+        hash_time      (float): Seconds spent computing cache keys.
+        lookup_time    (float): Seconds spent looking up the cache,
+            including deserialisation.
+        deserialize_time (float): Seconds spent deserialising results.
+        compute_time   (float): Seconds spent in the function on misses.
+        store_time     (float): Seconds spent serialising and storing
+            results.
+        bytes_read       (int): Bytes of results read from the cache.
+        bytes_written    (int): Bytes of results written to the cache.
+    """
+    FIELDS = ('hits', 'misses', 'hash_time', 'lookup_time',
+              'deserialize_time', 'compute_time', 'store_time',
+              'bytes_read', 'bytes_written')
+
+    def __init__(self):
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    def as_dict(self):
+        # type: () -> dict
+        return dict((field, getattr(self, field)) for field in self.FIELDS)
+
+
+def enable_stats():
+    """Start recording statistics."""
+    global enabled
+    enabled = True
+
+
+def disable_stats():
+    """Stop recording statistics.  Those already recorded are kept."""
+    global enabled
+    enabled = False
+
+
+def reset_stats():
+    """Discard all recorded statistics."""
+    with _lock:
+        _records.clear()
+
+
+def stats():
+    """Get the recorded statistics.
+
+    Return:
+        A dictionary mapping the qualified name of each decorated function
+        to a dictionary of the fields of :class:`OperationStats`.
+    """
+    # type: () -> dict
+    with _lock:
+        return dict((name, record.as_dict())
+                    for name, record in _records.items())
+
+
+def dump_stats(fh):
+    """Write the recorded statistics to a file as JSON."""
+    json.dump(stats(), fh, indent=2, sort_keys=True)
+
+
+def get_record(name):
+    # type: (str) -> OperationStats
+    """Get the statistics record for a function, creating it if needed."""
+    record = _records.get(name)
+    if record is None:
+        with _lock:
+            record = _records.setdefault(name, OperationStats())
+    return record
+
+
+class Recorder(object):
+    """Records the stages of a single call to a decorated function.
+
+    While the recorder is active, reads and writes by caches in the same
+    thread are attributed to its function.
+    """
+    def __init__(self, record):
+        # type: (OperationStats) -> None
+        self.record = record
+        self.previous = getattr(_current, 'record', None)
+        _current.record = record
+        self.start = clock()
+
+    def count(self, field):
+        # type: (str) -> None
+        """Increment a counter."""
+        setattr(self.record, field, getattr(self.record, field) + 1)
+
+    def lap(self, field):
+        # type: (str) -> None
+        """Add the time since the last lap to a field."""
+        now = clock()
+        setattr(self.record, field,
+                getattr(self.record, field) + now - self.start)
+        self.start = now
+
+    def finish(self):
+        # type: () -> None
+        """Stop attributing cache activity to this call."""
+        _current.record = self.previous
+
+
+class _NullRecorder(object):
+    """Recorder used when statistics are disabled."""
+    def count(self, field):
+        pass
+
+    def lap(self, field):
+        pass
+
+    def finish(self):
+        pass
+
+
+_null_recorder = _NullRecorder()
+
+
+def recorder(name):
+    # type: (str) -> Recorder
+    """Begin recording a call to the named function."""
+    if not enabled:
+        return _null_recorder
+    return Recorder(get_record(name))
+
+
+def record_read(seconds, nbytes):
+    # type: (float, int) -> None
+    """Record the deserialisation of a result by a cache."""
+    record = getattr(_current, 'record', None)
+    if record is not None:
+        record.deserialize_time += seconds
+        record.bytes_read += nbytes
+
+
+def record_write(nbytes):
+    # type: (int) -> None
+    """Record the writing of a result by a cache."""
+    record = getattr(_current, 'record', None)
+    if record is not None:
+        record.bytes_written += nbytes
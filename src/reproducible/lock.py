@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import contextlib
+import errno
+import os
+import socket
+import threading
+import time
+
+
+class KeyLocks(object):
+    """A set of in-process locks, one for each key in use.
+
+    Locks are created when first requested and discarded once no thread
+    holds or is waiting for them.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.locks = {}
+
+    @contextlib.contextmanager
+    def hold(self, key, timeout=None):
+        """Hold the lock for a key.
+
+        Args:
+            key       (str): The key to lock.
+            timeout (float): The maximum time in seconds to wait, or None
+                to wait indefinitely.
+
+        Return:
+            A context manager yielding True if the lock was acquired, or
+            False if the timeout expired.
+        """
+        with self.lock:
+            entry = self.locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            if timeout is None:
+                acquired = entry[0].acquire()
+            else:
+                acquired = entry[0].acquire(True, timeout)
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    entry[0].release()
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.locks[key]
+
+
+class FileLock(object):
+    """Cross-process lock based on exclusive creation of a lock file.
+
+    The lock file holds the host name and process ID of its owner, and its
+    modification time is refreshed periodically while the lock is held.
+    A lock file is considered stale, and is removed, if its owner is a
+    process on this host that no longer exists, or if it has not been
+    refreshed for ``stale_timeout`` seconds.
+    """
+    def __init__(self, path, timeout=None, stale_timeout=60.0,
+                 poll_interval=0.01):
+        """
+        Args:
+            path            (str): The lock file.
+            timeout       (float): The maximum time in seconds to wait, or
+                None to wait indefinitely.
+            stale_timeout (float): The time in seconds after which a lock
+                file that has not been refreshed is considered stale.
+            poll_interval (float): The initial time in seconds between
+                attempts to take the lock.
+        """
+        # type: (str, float, float, float) -> None
+        self.path = path
+        self.timeout = timeout
+        self.stale_timeout = stale_timeout
+        self.poll_interval = poll_interval
+        self.heartbeat = None
+        self.released = threading.Event()
+
+    def __owner(self):
+        # type: () -> str
+        return '%s %d' % (socket.gethostname(), os.getpid())
+
+    def __try_acquire(self):
+        # type: () -> bool
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY,
+                         0o644)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            return False
+        try:
+            os.write(fd, self.__owner().encode('utf8'))
+        finally:
+            os.close(fd)
+        return True
+
+    def __is_stale(self, st):
+        # type: (os.stat_result) -> bool
+        if time.time() - st.st_mtime > self.stale_timeout:
+            return True
+        try:
+            with open(self.path, 'rb') as fh:
+                host, pid = fh.read().decode('utf8').rsplit(' ', 1)
+            pid = int(pid)
+        except (IOError, OSError, ValueError):
+            # Missing, or still being written by its owner.
+            return False
+        if host != socket.gethostname():
+            return False
+        try:
+            os.kill(pid, 0)
+        except OSError as e:
+            return e.errno == errno.ESRCH
+        return False
+
+    def __break_stale(self):
+        # type: () -> bool
+        try:
+            st = os.stat(self.path)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return True
+            raise
+        if not self.__is_stale(st):
+            return False
+        try:
+            current = os.stat(self.path)
+            if (current.st_ino, current.st_mtime) == (st.st_ino, st.st_mtime):
+                os.unlink(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        return True
+
+    def __refresh(self):
+        # type: () -> None
+        while not self.released.wait(self.stale_timeout / 4):
+            try:
+                os.utime(self.path, None)
+            except OSError:
+                return
+
+    def acquire(self):
+        # type: () -> bool
+        """Take the lock, returning False if the timeout expires."""
+        deadline = None if self.timeout is None \
+            else time.time() + self.timeout
+        interval = self.poll_interval
+        while not self.__try_acquire():
+            if self.__break_stale():
+                continue
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(interval)
+            interval = min(interval * 2, 1.0)
+
+        self.released.clear()
+        self.heartbeat = threading.Thread(target=self.__refresh)
+        self.heartbeat.daemon = True
+        self.heartbeat.start()
+        return True
+
+    def release(self):
+        # type: () -> None
+        """Release the lock."""
+        self.released.set()
+        self.heartbeat.join()
+        self.heartbeat = None
+        try:
+            os.unlink(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    @contextlib.contextmanager
+    def hold(self):
+        """Hold the lock.
+
+        Return:
+            A context manager yielding True if the lock was acquired, or
+            False if the timeout expired.
+        """
+        acquired = self.acquire()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self.release()
+
+
+_key_locks = KeyLocks()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import atexit
+import os
+import sqlite3
+import threading
+import time
+import weakref
+
+import reproducible
+from . import instrumentation
+from .cache import Cache, MISS, _type_identifier, _resolve_type_identifier
+
+_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS entries ('
+    ' key TEXT PRIMARY KEY,'
+    ' type TEXT NOT NULL,'
+    ' payload BLOB NOT NULL,'
+    ' size INTEGER NOT NULL,'
+    ' last_access REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS entries_last_access'
+    ' ON entries (last_access)',
+]
+
+_SELECT = 'SELECT type, payload FROM entries WHERE key = ?'
+_SELECT_MANY = 'SELECT key, type, payload FROM entries WHERE key IN (%s)'
+_EXISTS = 'SELECT 1 FROM entries WHERE key = ?'
+_INSERT = 'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)'
+_TOUCH = 'UPDATE entries SET last_access = ? WHERE key = ?'
+
+# Older versions of SQLite allow at most 999 parameters per statement.
+_MAX_PARAMETERS = 900
+
+
+class SqliteCache(Cache):
+    """SQLite-backed cache.
+
+    SqliteCache stores the cache in a single SQLite database file, which
+    scales better than a directory per entry on network and overlay
+    filesystems.  Each entry holds the data type identifier, the
+    serialised data, its size, and the time it was last read.
+
+    The database uses write-ahead logging, so that many processes can read
+    from it while another writes.  Writes are batched: they are held in
+    memory and committed in a single transaction once ``batch_size`` of
+    them are pending or ``batch_interval`` seconds have passed, when
+    :meth:`flush` is called, or when the interpreter exits.  Updates to the
+    last-access times of entries are batched in the same way.
+    """
+    def __init__(self, path, batch_size=100, batch_interval=1.0,
+                 timeout=60.0):
+        """
+        Args:
+            path             (str): The database file.
+            batch_size       (int): The number of writes to commit at once.
+            batch_interval (float): The maximum time in seconds for which a
+                write may remain uncommitted.
+            timeout        (float): The time in seconds to wait for another
+                process to release a lock on the database.
+        """
+        # type: (str, int, float, float) -> None
+        super(SqliteCache, self).__init__()
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.timeout = timeout
+        self.local = threading.local()
+        self._mutex = threading.Lock()
+        self.pending = {}
+        self.accessed = {}
+        self.timer = None
+
+        with self.__connect() as connection:
+            for statement in _SCHEMA:
+                connection.execute(statement)
+
+        this = weakref.ref(self)
+        atexit.register(lambda: this() is not None and this().flush())
+
+    def __connect(self):
+        # type: () -> sqlite3.Connection
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def __schedule_flush(self):
+        # type: () -> None
+        if len(self.pending) + len(self.accessed) >= self.batch_size:
+            self.flush()
+        elif self.timer is None:
+            with self._mutex:
+                if self.timer is None:
+                    self.timer = threading.Timer(self.batch_interval,
+                                                 self.flush)
+                    self.timer.daemon = True
+                    self.timer.start()
+
+    def __add_pending(self, key, value):
+        # type: (str, reproducible.data.Data) -> None
+        payload = value.dumps()
+        if instrumentation.enabled:
+            instrumentation.record_write(len(payload))
+        with self._mutex:
+            self.accessed.pop(key, None)
+            self.pending[key] = (key, _type_identifier(type(value)).decode(
+                'utf8'), sqlite3.Binary(payload), len(payload), time.time())
+
+    def set(self, key, value):
+        # type: (str, reproducible.data.Data) -> None
+        self.__add_pending(key, value)
+        self.__schedule_flush()
+
+    def set_many(self, items):
+        """Store several values, committing them in one transaction."""
+        # type: (list) -> None
+        for key, value in items:
+            self.__add_pending(key, value)
+        self.flush()
+
+    def get(self, key):
+        # type: (str) -> object
+        value = self.get_or_miss(key)
+        if value is MISS:
+            raise KeyError(key)
+        return value
+
+    def get_or_miss(self, key):
+        # type: (str) -> object
+        row = self.pending.get(key)
+        if row is not None:
+            return self.__load(row[1:3])
+        row = self.__connect().execute(_SELECT, (key, )).fetchone()
+        if row is None:
+            return MISS
+        self.accessed[key] = time.time()
+        self.__schedule_flush()
+        return self.__load(row)
+
+    def get_many(self, keys):
+        """Look up several keys with as few queries as possible."""
+        # type: (list) -> list
+        rows = {}
+        remaining = []
+        for key in keys:
+            row = self.pending.get(key)
+            if row is not None:
+                rows[key] = row[1:3]
+            else:
+                remaining.append(key)
+        connection = self.__connect()
+        now = time.time()
+        accessed = False
+        for i in range(0, len(remaining), _MAX_PARAMETERS):
+            chunk = remaining[i:i + _MAX_PARAMETERS]
+            for key, data_type, payload in connection.execute(
+                    _SELECT_MANY % ', '.join('?' * len(chunk)), chunk):
+                rows[key] = (data_type, payload)
+                self.accessed[key] = now
+                accessed = True
+        if accessed:
+            self.__schedule_flush()
+        return [MISS if key not in rows else self.__load(rows[key])
+                for key in keys]
+
+    def __load(self, row):
+        # type: (tuple) -> reproducible.data.Data
+        start = instrumentation.clock() if instrumentation.enabled else None
+        data_type = _resolve_type_identifier(row[0].encode('utf8'))
+        value = data_type.loads(bytes(row[1]))
+        if start is not None:
+            instrumentation.record_read(instrumentation.clock() - start,
+                                        len(row[1]))
+        return value
+
+    def is_cached(self, key):
+        # type: (str) -> bool
+        return key in self.pending or self.__connect().execute(
+            _EXISTS, (key, )).fetchone() is not None
+
+    def flush(self):
+        # type: () -> None
+        """Commit all pending writes."""
+        with self._mutex:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            pending, self.pending = self.pending, {}
+            accessed, self.accessed = self.accessed, {}
+        if not pending and not accessed:
+            return
+        try:
+            with self.__connect() as connection:
+                connection.executemany(_INSERT, pending.values())
+                connection.executemany(
+                    _TOUCH, [(t, key) for key, t in accessed.items()])
+        except Exception:
+            with self._mutex:
+                pending.update(self.pending)
+                self.pending = pending
+            raise
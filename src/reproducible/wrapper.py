@@ -4,13 +4,110 @@ from __future__ import absolute_import, division, print_function, \
     unicode_literals
 
 import base64
+import collections
 import functools
 import inspect
+import threading
+
+try:
+    import concurrent.futures
+except ImportError:  # pragma: no cover
+    concurrent = None
 
 import reproducible
+from . import dependencies, instrumentation
+
+
+class _SourceFingerprint(object):
+    """Memoised hash of a function's source code and its dependencies.
+
+    The hash covers the source of the function itself and the code of the
+    user functions and classes that it uses, transitively; see
+    :mod:`reproducible.dependencies`.  It is computed on first use and
+    recomputed only when the modification time of one of the files
+    involved changes, so that a cache hit does not need to inspect or hash
+    the source again.  Code without a file, such as that of a notebook
+    cell, has no modification time, and so its dependencies are looked up
+    again, from their memoised digests, on every call.
+    """
+    def __init__(self, func):
+        self.func = func
+        self.filename = func.__code__.co_filename
+        self.files = {}
+        self.hash = None
+
+    def __is_current(self):
+        # type: () -> bool
+        if self.hash is None:
+            return False
+        for filename, modification_time in self.files.items():
+            if modification_time is None or \
+                    dependencies.modification_time(filename) != \
+                    modification_time:
+                return False
+        return True
+
+    def hexdigest(self):
+        # type: () -> str
+        if self.__is_current():
+            return self.hash
+
+        modification_time = dependencies.modification_time(self.filename)
+        source_digest = dependencies.source_digest(self.func)
+        entries, files = dependencies.dependencies(self.func)
+        if [digest for _, digest in entries] == [source_digest]:
+            # Functions without dependencies keep the hash of their source
+            # alone, so that their existing cache entries remain valid.
+            self.hash = source_digest
+        else:
+            hash_context = reproducible.hash_family()
+            hash_context.update(source_digest.encode('ascii'))
+            for name, digest in entries:
+                hash_context.update(('%s=%s;' % (name, digest))
+                                    .encode('utf8'))
+            self.hash = base64.b16encode(hash_context.digest()).decode(
+                'ascii')
+
+        files[self.filename] = modification_time
+        self.files = files
+        return self.hash
+
+
+_is_coroutine_function = getattr(inspect, 'iscoroutinefunction',
+                                 lambda func: False)
+
+
+def _call_uncached(wrapper, args, kwargs):
+    """Call the function underlying a decorated function.
+
+    This is what an executor runs, and refers to the decorated function,
+    rather than the original, so that it can be pickled for a process pool.
+    """
+    return wrapper.__wrapped__(*args, **kwargs)
+
 
+def _value(obj):
+    # type: (object) -> object
+    if isinstance(obj, reproducible.LazyData):
+        return obj.value
+    return obj
 
-def operation(func):
+
+def _materialise(args, kwargs):
+    # type: (tuple, dict) -> tuple
+    """Load any lazy results passed as arguments."""
+    return (tuple(_value(arg) for arg in args),
+            dict((key, _value(value)) for key, value in kwargs.items()))
+
+
+def _completed(value):
+    # type: (object) -> Future
+    future = concurrent.futures.Future()
+    future.set_result(value)
+    return future
+
+
+def operation(func=None, executor=None, blocking=False, lazy=False):
     """Make a function cacheable.
 
     The ``@operation`` decorator makes a function cacheable, with the cache
@@ -38,45 +135,315 @@ def operation(func):
     are special cases for some types, such as `numpy.ndarray`, but in
     general the cache id will be given by the SHA-256 checksum of the
     pickled value of the object.
-    """
 
-    def make_cache_value(value):
-        # type: (object) -> str
-        if isinstance(value, reproducible.Data):
-            return value.cache_id(None)
-        else:
-            return reproducible.get_data_wrapper(value).cache_id(None)
+    If several threads or processes sharing a cache call the function with
+    the same arguments at once, only one of them computes the result, while
+    the others wait for it to be stored; see `reproducible.Cache.lock`.
 
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        cache = reproducible.get_cache()
+    The decorated function has a ``map`` method, which calls it on many
+    sets of arguments at once, in the manner of the builtin ``map``:
+
+        >>> fun.map([1, 2, 3])
+        Executing fun(3)
+        [1, 2, 3]
+
+    All of the cache keys are computed first, and looked up with a single
+    call to `reproducible.Cache.get_many`.  The misses are then computed in
+    order and stored with a single call to `reproducible.Cache.set_many`.
+    Repeated arguments are computed only once.  Unlike individual calls,
+    ``map`` does not wait for other callers computing the same values.
+
+    Misses may instead be computed by a `concurrent.futures` executor, so
+    that many of them run at once:
+
+        >>> pool = concurrent.futures.ProcessPoolExecutor()
+        >>> @reproducible.operation(executor=pool)
+        ... def simulate(seed):
+        ...     ...
+        >>> futures = simulate.map(range(100))
+
+    Each call then returns a `concurrent.futures.Future`, which is already
+    complete on a cache hit.  Each result is stored in the cache as soon as
+    it has been computed, before its future completes.  Calls with the same
+    arguments made while a result is being computed share its future, but
+    callers in other processes are not made to wait for it.  A process pool
+    can only be used with functions defined at the top level of a module.
+
+    In a chain of cached calls such as ``c(b(a(x)))``, each hit loads its
+    result only for the next call to hash it again.  With ``lazy=True``, a
+    call instead returns a `reproducible.LazyData` proxy whose cache id is
+    the cache key of the result, and which loads the result only when its
+    ``value`` is used.  Proxies passed directly as arguments are loaded
+    before the function is called on a miss, so a fully cached chain costs
+    a lookup for each call and a single load:
+
+        >>> @reproducible.operation(lazy=True)
+        ... def load_table(path):
+        ...     ...
+        >>> table = load_table('data.csv')
+        >>> summary = summarise(table).value
 
+    Coroutine functions are supported: the decorated function is then also
+    a coroutine function, whose result is awaited and cached, and whose
+    ``map`` method must be awaited.  Cache lookups and writes are run on
+    the default executor of the event loop, and concurrent awaits of the
+    same arguments share one computation.
+
+    Args:
+        func      (function): The function to make cacheable.
+        executor  (Executor): The executor on which to compute misses, or
+            None to compute them in the caller.
+        blocking      (bool): If true, calls using an executor wait for and
+            return their results rather than futures.  Parallelism is then
+            only gained through ``map``, or by calling from several threads.
+        lazy          (bool): If true, calls return a
+            `reproducible.LazyData` proxy, and a hit only checks that the
+            result is cached without loading it.
+    """
+    if func is None:
+        return functools.partial(operation, executor=executor,
+                                 blocking=blocking, lazy=lazy)
+
+    source_fingerprint = _SourceFingerprint(func)
+    stats_name = '%s.%s' % (func.__module__,
+                            getattr(func, '__qualname__', func.__name__))
+
+    def make_cache_key(args, kwargs):
+        # type: (tuple, dict) -> str
         cache_string_parts = []
         for i, arg in enumerate(args):
             if not reproducible.cache_ignored(arg):
-                cache_value = make_cache_value(arg)
+                cache_value = reproducible.get_cache_id(arg)
                 cache_string_parts.append('arg_%d=%s' % (i, cache_value))
 
         for key in sorted(kwargs):
             if not reproducible.cache_ignored(kwargs[key]):
-                cache_value = make_cache_value(kwargs[key])
+                cache_value = reproducible.get_cache_id(kwargs[key])
                 cache_string_parts.append('kwarg_%s=%s' % (key, cache_value))
 
-        hash_context = reproducible.hash_family()
-        hash_context.update(inspect.getsource(func).encode('utf8'))
-        func_hash = base64.b16encode(hash_context.digest()).decode('ascii')
+        func_hash = source_fingerprint.hexdigest()
 
         hash_context = reproducible.hash_family()
         cache_string = '%s[%s]' % (func_hash, ':'.join(cache_string_parts))
         hash_context.update(cache_string.encode('utf8'))
-        cache_key = func.__name__ + '.' + \
+        return func.__name__ + '.' + \
             base64.b16encode(hash_context.digest()).decode('utf8')
 
-        if cache.is_cached(cache_key):
-            return cache.get(cache_key).value
+    in_flight = {}
+    in_flight_lock = threading.Lock()
+
+    def submit(cache, cache_key, args, kwargs):
+        # type: (reproducible.Cache, str, tuple, dict) -> Future
+        with in_flight_lock:
+            future = in_flight.get(cache_key)
+            if future is not None:
+                return future
+            future = in_flight[cache_key] = concurrent.futures.Future()
+
+        def store(computation):
+            try:
+                result = computation.result()
+                cache.set(cache_key,
+                          reproducible.get_data_wrapper(_value(result)))
+            except BaseException as e:
+                with in_flight_lock:
+                    del in_flight[cache_key]
+                future.set_exception(e)
+            else:
+                with in_flight_lock:
+                    del in_flight[cache_key]
+                future.set_result(result)
+
+        args, kwargs = _materialise(args, kwargs)
+        executor.submit(_call_uncached, wrapper, args, kwargs) \
+            .add_done_callback(store)
+        return future
+
+    def call_with_executor(*args, **kwargs):
+        cache = reproducible.get_cache()
+        recorder = instrumentation.recorder(stats_name)
+        try:
+            cache_key = make_cache_key(args, kwargs)
+            recorder.lap('hash_time')
+
+            cached = cache.get_or_miss(cache_key)
+            recorder.lap('lookup_time')
+            if cached is not reproducible.MISS:
+                recorder.count('hits')
+                future = _completed(cached.value)
+            else:
+                recorder.count('misses')
+                future = submit(cache, cache_key, args, kwargs)
+        finally:
+            recorder.finish()
+        return future.result() if blocking else future
+
+    def map_with_executor(*iterables, **kwargs):
+        cache = reproducible.get_cache()
+        recorder = instrumentation.recorder(stats_name)
+        try:
+            calls = list(zip(*iterables))
+            cache_keys = [make_cache_key(args, kwargs) for args in calls]
+            recorder.lap('hash_time')
+
+            unique_keys = list(collections.OrderedDict.fromkeys(cache_keys))
+            values = dict(zip(unique_keys, cache.get_many(unique_keys)))
+            recorder.lap('lookup_time')
+
+            futures = {}
+            for args, cache_key in zip(calls, cache_keys):
+                if cache_key in futures:
+                    continue
+                cached = values[cache_key]
+                if cached is not reproducible.MISS:
+                    recorder.count('hits')
+                    futures[cache_key] = _completed(cached.value)
+                else:
+                    recorder.count('misses')
+                    futures[cache_key] = submit(cache, cache_key, args,
+                                                kwargs)
+        finally:
+            recorder.finish()
+        if blocking:
+            return [futures[cache_key].result() for cache_key in cache_keys]
+        return [futures[cache_key] for cache_key in cache_keys]
+
+    if lazy and executor is not None:
+        raise TypeError('Lazy operations cannot use an executor')
+    if _is_coroutine_function(func):
+        if executor is not None or lazy:
+            raise TypeError('Coroutine functions cannot use an executor or '
+                            'be lazy')
+        from .coroutine import wrap_coroutine
+        return wrap_coroutine(func, make_cache_key, stats_name)
+
+    def load(cache, cache_key, args, kwargs):
+        # type: (reproducible.Cache, str, tuple, dict) -> object
+        cached = cache.get_or_miss(cache_key)
+        if cached is not reproducible.MISS:
+            return cached.value
+        # The entry has been removed since it was found, so compute it again.
+        recorder = instrumentation.recorder(stats_name)
+        try:
+            return _value(compute(cache, cache_key, args, kwargs, recorder))
+        finally:
+            recorder.finish()
+
+    def lookup(cache, cache_key, args, kwargs):
+        # type: (reproducible.Cache, str, tuple, dict) -> object
+        if not lazy:
+            cached = cache.get_or_miss(cache_key)
+            return cached if cached is reproducible.MISS else cached.value
+        if not cache.is_cached(cache_key):
+            return reproducible.MISS
+        return reproducible.LazyData(cache_key, functools.partial(
+            load, cache, cache_key, args, kwargs))
+
+    def compute(cache, cache_key, args, kwargs, recorder):
+        # type: (reproducible.Cache, str, tuple, dict, object) -> object
+        # If another caller is already computing this value, wait for it
+        # to finish and use its result.  Should the wait time out, we
+        # compute the value ourselves.
+        with cache.lock(cache_key):
+            cached = cache.get_or_miss(cache_key)
+            recorder.lap('lookup_time')
+            if cached is not reproducible.MISS:
+                recorder.count('hits')
+                result = cached.value
+            else:
+                recorder.count('misses')
+                call_args, call_kwargs = _materialise(args, kwargs)
+                result = _value(func(*call_args, **call_kwargs))
+                recorder.lap('compute_time')
+                cache.set(cache_key, reproducible.get_data_wrapper(result))
+                recorder.lap('store_time')
+        return reproducible.LazyData.loaded(cache_key, result) if lazy \
+            else result
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if executor is not None:
+            return call_with_executor(*args, **kwargs)
+
+        cache = reproducible.get_cache()
+        recorder = instrumentation.recorder(stats_name)
+        try:
+            cache_key = make_cache_key(args, kwargs)
+            recorder.lap('hash_time')
+
+            result = lookup(cache, cache_key, args, kwargs)
+            recorder.lap('lookup_time')
+            if result is not reproducible.MISS:
+                recorder.count('hits')
+                return result
+            return compute(cache, cache_key, args, kwargs, recorder)
+        finally:
+            recorder.finish()
+
+    def map(*iterables, **kwargs):
+        """Call the function on each set of arguments taken from iterables.
+
+        Args:
+            *iterables: Iterables of positional arguments, one for each
+                parameter, as for the builtin ``map``.
+            **kwargs: Keyword arguments passed to every call.
+
+        Return:
+            A list of the results, in order, or of futures for them if the
+            function uses an executor and is not blocking.
+        """
+        if executor is not None:
+            return map_with_executor(*iterables, **kwargs)
+
+        cache = reproducible.get_cache()
+        recorder = instrumentation.recorder(stats_name)
+        try:
+            calls = list(zip(*iterables))
+            cache_keys = [make_cache_key(args, kwargs) for args in calls]
+            recorder.lap('hash_time')
+
+            unique_calls = collections.OrderedDict()
+            for args, cache_key in zip(calls, cache_keys):
+                unique_calls.setdefault(cache_key, args)
+            if lazy:
+                values = [lookup(cache, cache_key, args, kwargs)
+                          for cache_key, args in unique_calls.items()]
+            else:
+                values = [value if value is reproducible.MISS
+                          else value.value
+                          for value in cache.get_many(list(unique_calls))]
+            recorder.lap('lookup_time')
+
+            results = {}
+            computed = []
+            for (cache_key, args), result in zip(unique_calls.items(),
+                                                 values):
+                if result is not reproducible.MISS:
+                    recorder.count('hits')
+                    results[cache_key] = result
+                    continue
+                recorder.count('misses')
+                call_args, call_kwargs = _materialise(args, kwargs)
+                result = _value(func(*call_args, **call_kwargs))
+                recorder.lap('compute_time')
+                results[cache_key] = reproducible.LazyData.loaded(
+                    cache_key, result) if lazy else result
+                computed.append(
+                    (cache_key, reproducible.get_data_wrapper(result)))
+
+            if computed:
+                cache.set_many(computed)
+                recorder.lap('store_time')
+            return [results[cache_key] for cache_key in cache_keys]
+        finally:
+            recorder.finish()
 
-        result = func(*args, **kwargs)
-        cache.set(cache_key, reproducible.get_data_wrapper(result))
-        return result
+    def cache_key(*args, **kwargs):
+        """Compute the cache key of a call without making it."""
+        return make_cache_key(args, kwargs)
 
+    wrapper.map = map
+    wrapper.cache_key = cache_key
+    # Set by functools.wraps only on Python 3.
+    wrapper.__wrapped__ = func
     return wrapper
@@ -3,8 +3,13 @@
 from __future__ import absolute_import, division, print_function, \
     unicode_literals
 
+import os
+import pickle
+import pytest
+import socket
 import sys
 import tempfile
+import threading
 
 import reproducible
 import numpy
@@ -15,6 +20,21 @@ class PlaceholderClass:
     pass
 
 
+class DictCache(reproducible.Cache):
+    """A cache implementing only the required methods."""
+    def __init__(self):
+        self.items = {}
+
+    def set(self, key, value):
+        self.items[key] = value
+
+    def get(self, key):
+        return self.items[key]
+
+    def is_cached(self, key):
+        return key in self.items
+
+
 def test_memory_cache():
     cache = reproducible.MemoryCache()
 
@@ -83,5 +103,454 @@ def test_file_cache_numpy():
         cache.set('foo', reproducible.get_data_wrapper(x))
         assert cache.is_cached('foo')
         assert (cache.get('foo').value == x).all()
+
+        cache = reproducible.FileCache(root_dir)
+        assert isinstance(cache.get_or_miss('foo').value, numpy.memmap)
+    finally:
+        shutil.rmtree(root_dir)
+
+
+def test_memory_cache_get_or_miss():
+    cache = reproducible.MemoryCache()
+
+    cache.set('foo', reproducible.get_data_wrapper('bar'))
+    assert cache.get_or_miss('foo').value == 'bar'
+    assert cache.get_or_miss('baz') is reproducible.MISS
+
+
+def test_file_cache_get_or_miss():
+    root_dir = tempfile.mkdtemp()
+    try:
+        cache = reproducible.FileCache(root_dir, debug=sys.stdout)
+
+        cache.set('foo', reproducible.get_data_wrapper('bar'))
+        assert cache.get_or_miss('foo').value == 'bar'
+        assert cache.get_or_miss('baz') is reproducible.MISS
+    finally:
+        shutil.rmtree(root_dir)
+
+
+def test_cache_default_get_or_miss():
+    cache = DictCache()
+    cache.set('foo', reproducible.get_data_wrapper('bar'))
+    assert cache.get_or_miss('foo').value == 'bar'
+    assert cache.get_or_miss('baz') is reproducible.MISS
+
+
+@pytest.mark.parametrize('cache_type',
+                         ['memory', 'bounded', 'file', 'tiered', 'sqlite',
+                          'default'])
+def test_cache_get_many(cache_type):
+    root_dir = tempfile.mkdtemp()
+    try:
+        cache = {
+            'memory': lambda: reproducible.MemoryCache(),
+            'bounded': lambda: reproducible.BoundedMemoryCache(),
+            'file': lambda: reproducible.FileCache(root_dir),
+            'tiered': lambda: reproducible.TieredCache(
+                reproducible.FileCache(root_dir)),
+            'sqlite': lambda: reproducible.SqliteCache(
+                os.path.join(root_dir, 'cache.db')),
+            'default': DictCache,
+        }[cache_type]()
+
+        assert cache.get_many([]) == []
+        cache.set_many([(str(i), reproducible.get_data_wrapper(i))
+                        for i in range(5)])
+        cache.set('x', reproducible.get_data_wrapper('y'))
+
+        values = cache.get_many(['4', 'missing', 'x', '0', '4'])
+        assert [value.value for value in values if
+                value is not reproducible.MISS] == [4, 'y', 0, 4]
+        assert values[1] is reproducible.MISS
+        assert cache.get_or_miss('3').value == 3
+        if cache_type == 'sqlite':
+            cache.flush()
+    finally:
+        shutil.rmtree(root_dir)
+
+
+def test_sqlite_cache_get_many_large():
+    root_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(root_dir, 'cache.db')
+        cache = reproducible.SqliteCache(path)
+        cache.set_many([(str(i), reproducible.get_data_wrapper(i))
+                        for i in range(0, 2000, 2)])
+
+        other = reproducible.SqliteCache(path)
+        values = other.get_many([str(i) for i in range(2000)])
+        assert [value.value for value in values[::2]] == \
+            list(range(0, 2000, 2))
+        assert all(value is reproducible.MISS for value in values[1::2])
+        other.flush()
+    finally:
+        shutil.rmtree(root_dir)
+
+
+def test_bounded_memory_cache_entries():
+    cache = reproducible.BoundedMemoryCache(max_entries=2)
+
+    cache.set('a', reproducible.get_data_wrapper(1))
+    cache.set('b', reproducible.get_data_wrapper(2))
+    assert cache.get_or_miss('a').value == 1
+    cache.set('c', reproducible.get_data_wrapper(3))
+
+    assert cache.is_cached('a')
+    assert not cache.is_cached('b')
+    assert cache.is_cached('c')
+    assert cache.get_or_miss('b') is reproducible.MISS
+    assert cache.evictions == 1
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+def test_bounded_memory_cache_bytes():
+    cache = reproducible.BoundedMemoryCache(max_bytes=2000)
+
+    cache.set('a', reproducible.get_data_wrapper(numpy.zeros(100)))
+    cache.set('b', reproducible.get_data_wrapper(numpy.zeros(100)))
+    assert cache.size == 1600
+    cache.set('c', reproducible.get_data_wrapper(numpy.zeros(100)))
+    assert cache.size == 1600
+    assert not cache.is_cached('a')
+    assert cache.evictions == 1
+
+    cache.set('d', reproducible.get_data_wrapper(numpy.zeros(1000)))
+    assert not cache.is_cached('d')
+    assert cache.size == 1600
+
+    cache.set('b', reproducible.get_data_wrapper('x'))
+    assert cache.size < 1600
+    assert cache.get('b').value == 'x'
+
+
+def test_bounded_memory_cache_threads():
+    cache = reproducible.BoundedMemoryCache(max_entries=50, max_bytes=4000)
+
+    def work(offset):
+        for i in range(2000):
+            key = str((i * 7 + offset) % 100)
+            if cache.get_or_miss(key) is reproducible.MISS:
+                cache.set(key, reproducible.get_data_wrapper(numpy.zeros(8)))
+
+    threads = [threading.Thread(target=work, args=(offset, ))
+               for offset in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(cache.cache) <= 50
+    assert cache.size == 64 * len(cache.cache)
+    assert cache.hits + cache.misses == 8 * 2000
+
+
+def test_tiered_cache():
+    root_dir = tempfile.mkdtemp()
+    try:
+        backing = reproducible.FileCache(root_dir)
+        cache = reproducible.TieredCache(backing)
+
+        cache.set('foo', reproducible.get_data_wrapper('bar'))
+        assert backing.get('foo').value == 'bar'
+        assert cache.memory.is_cached('foo')
+        assert cache.get_or_miss('foo').value == 'bar'
+        assert cache.get_or_miss('baz') is reproducible.MISS
+
+        backing.set('baz', reproducible.get_data_wrapper('qux'))
+        assert not cache.memory.is_cached('baz')
+        assert cache.is_cached('baz')
+        assert cache.get_or_miss('baz').value == 'qux'
+        assert cache.memory.is_cached('baz')
+    finally:
+        shutil.rmtree(root_dir)
+
+
+def test_tiered_cache_get_missing():
+    cache = reproducible.TieredCache(reproducible.MemoryCache())
+    assert cache.get('foo') is None
+    assert not cache.memory.is_cached('foo')
+    assert cache.get_or_miss('foo') is reproducible.MISS
+
+
+def test_file_cache_incomplete_entry():
+    root_dir = tempfile.mkdtemp()
+    try:
+        cache = reproducible.FileCache(root_dir)
+
+        # An entry left behind by an interrupted writer.
+        os.mkdir(os.path.join(root_dir, 'foo'))
+        with open(os.path.join(root_dir, 'foo', 'data'), 'wb') as fh:
+            fh.write(b'\x80')
+        assert not cache.is_cached('foo')
+        assert cache.get_or_miss('foo') is reproducible.MISS
+
+        cache.set('foo', reproducible.get_data_wrapper('bar'))
+        assert cache.get_or_miss('foo').value == 'bar'
+        cache.set('foo', reproducible.get_data_wrapper('baz'))
+        assert cache.get_or_miss('foo').value == 'baz'
+        assert os.path.isfile(cache.path('foo'))
+    finally:
+        shutil.rmtree(root_dir)
+
+
+def test_file_cache_interrupted_write():
+    class InterruptedData(reproducible.ObjectData):
+        def dump(self, fh):
+            fh.write(b'\x80')
+            raise KeyboardInterrupt()
+
+    root_dir = tempfile.mkdtemp()
+    try:
+        cache = reproducible.FileCache(root_dir, fsync=True)
+        with pytest.raises(KeyboardInterrupt):
+            cache.set('foo', InterruptedData('bar'))
+        assert not cache.is_cached('foo')
+        assert not os.path.exists(cache.path('foo'))
+        assert [name for name in os.listdir(root_dir)
+                if name.startswith(cache.TEMPORARY_PREFIX)] == []
+    finally:
+        shutil.rmtree(root_dir)
+
+
+def test_file_cache_legacy_entry():
+    root_dir = tempfile.mkdtemp()
+    try:
+        cache = reproducible.FileCache(root_dir)
+
+        os.mkdir(os.path.join(root_dir, 'foo'))
+        data = reproducible.get_data_wrapper('bar')
+        with open(os.path.join(root_dir, 'foo', 'data'), 'wb') as fh:
+            data.dump(fh)
+        with open(os.path.join(root_dir, 'foo', 'type'), 'wb') as fh:
+            pickle.dump(type(data), fh)
+        open(os.path.join(root_dir, 'foo', cache.COMMIT_MARKER), 'wb').close()
+
+        assert cache.is_cached('foo')
+        assert cache.get_or_miss('foo').value == 'bar'
+        cache.set('foo', reproducible.get_data_wrapper('baz'))
+        assert cache.get_or_miss('foo').value == 'baz'
+    finally:
+        shutil.rmtree(root_dir)
+
+
+def test_file_cache_unmarked_legacy_entry():
+    root_dir = tempfile.mkdtemp()
+    try:
+        cache = reproducible.FileCache(root_dir)
+
+        # Entries written before commit markers were introduced.
+        data = reproducible.get_data_wrapper('bar')
+        for key in ('complete', 'interrupted'):
+            os.mkdir(os.path.join(root_dir, key))
+            with open(os.path.join(root_dir, key, 'data'), 'wb') as fh:
+                data.dump(fh)
+        with open(os.path.join(root_dir, 'complete', 'type'), 'wb') as fh:
+            pickle.dump(type(data), fh)
+        open(os.path.join(root_dir, 'interrupted', 'type'), 'wb').close()
+
+        assert cache.is_cached('complete')
+        assert cache.get_or_miss('complete').value == 'bar'
+        assert not cache.is_cached('interrupted')
+        assert cache.get_or_miss('interrupted') is reproducible.MISS
+
+        result = cache.gc(max_age=3600)
+        assert result['remaining']['entries'] == 1
+        assert cache.is_cached('complete')
+        assert not os.path.exists(os.path.join(root_dir, 'interrupted'))
+    finally:
+        shutil.rmtree(root_dir)
+
+
+def test_file_cache_corrupt_entry():
+    root_dir = tempfile.mkdtemp()
+    try:
+        cache = reproducible.FileCache(root_dir, verify=True)
+        cache.set('foo', reproducible.get_data_wrapper(b'x' * 1000))
+        with open(cache.path('foo'), 'r+b') as fh:
+            fh.seek(-1, os.SEEK_END)
+            fh.write(b'y')
+        with pytest.raises(IOError):
+            cache.get_or_miss('foo')
+
+        with open(cache.path('foo'), 'r+b') as fh:
+            fh.truncate(100)
+        with pytest.raises(IOError):
+            reproducible.FileCache(root_dir).get_or_miss('foo')
+    finally:
+        shutil.rmtree(root_dir)
+
+
+def test_sqlite_cache():
+    root_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(root_dir, 'cache.db')
+        cache = reproducible.SqliteCache(path, batch_size=3)
+
+        cache.set('foo', reproducible.get_data_wrapper('bar'))
+        assert cache.is_cached('foo')
+        assert cache.get_or_miss('foo').value == 'bar'
+        assert cache.get_or_miss('baz') is reproducible.MISS
+        assert not cache.is_cached('baz')
+
+        other = reproducible.SqliteCache(path)
+        assert not other.is_cached('foo')
+        cache.flush()
+        assert other.get('foo').value == 'bar'
+
+        x = numpy.random.randn(100, 2)
+        cache.set('x', reproducible.get_data_wrapper(x))
+        cache.set('y', reproducible.get_data_wrapper([1, 2]))
+        cache.set('z', reproducible.get_data_wrapper('z'))
+        assert (other.get('x').value == x).all()
+        assert other.get('y').value == [1, 2]
+        with pytest.raises(KeyError):
+            other.get('w')
+        other.flush()
+    finally:
+        shutil.rmtree(root_dir)
+
+
+def test_file_cache_lock():
+    root_dir = tempfile.mkdtemp()
+    try:
+        cache = reproducible.FileCache(root_dir, lock_timeout=0.1)
+        other = reproducible.FileCache(root_dir, lock_timeout=0.1)
+        with cache.lock('foo') as acquired:
+            assert acquired
+            assert os.path.exists(cache.path('foo') + '.lock')
+            # Simulate another process by bypassing the in-process lock.
+            file_lock = reproducible.lock.FileLock(
+                other.path('foo') + '.lock', timeout=0.1)
+            with file_lock.hold() as other_acquired:
+                assert not other_acquired
+        assert not os.path.exists(cache.path('foo') + '.lock')
+    finally:
+        shutil.rmtree(root_dir)
+
+
+def test_file_cache_stale_lock():
+    root_dir = tempfile.mkdtemp()
+    try:
+        cache = reproducible.FileCache(root_dir, lock_timeout=1.0,
+                                       stale_lock_timeout=5.0)
+        cache.set('foo', reproducible.get_data_wrapper('bar'))
+        lock_path = cache.path('foo') + '.lock'
+
+        # A lock left by a process that no longer exists.
+        with open(lock_path, 'w') as fh:
+            fh.write('%s %d' % (socket.gethostname(), 2**22 + 1))
+        with cache.lock('foo') as acquired:
+            assert acquired
+
+        # A lock that has not been refreshed for too long.
+        with open(lock_path, 'w') as fh:
+            fh.write('otherhost 1')
+        os.utime(lock_path, (0, 0))
+        with cache.lock('foo') as acquired:
+            assert acquired
+    finally:
+        shutil.rmtree(root_dir)
+
+
+@pytest.mark.parametrize('codec', reproducible.codec.available_codecs())
+def test_file_cache_codec(codec):
+    root_dir = tempfile.mkdtemp()
+    try:
+        cache = reproducible.FileCache(
+            root_dir, codec=codec, codec_threshold=100, verify=True,
+            type_codecs={reproducible.ArrayData: None})
+
+        def stored_codec(key):
+            with open(cache.path(key), 'rb') as fh:
+                return cache.HEADER.unpack(fh.read(cache.HEADER.size))[2]
+
+        identifier = reproducible.codec.get_codec(codec).identifier
+
+        cache.set('small', reproducible.get_data_wrapper('x'))
+        assert stored_codec('small') == 0
+        cache.set('large', reproducible.get_data_wrapper('x' * 10000))
+        assert stored_codec('large') == identifier
+        assert os.path.getsize(cache.path('large')) < 10000
+
+        x = numpy.zeros(10000)
+        cache.set('array', reproducible.get_data_wrapper(x))
+        assert stored_codec('array') == 0
+
+        noise = os.urandom(10000)
+        cache.set('noise', reproducible.get_data_wrapper(noise))
+        assert stored_codec('noise') == 0
+
+        reader = reproducible.FileCache(root_dir)
+        assert reader.get('small').value == 'x'
+        assert reader.get('large').value == 'x' * 10000
+        assert isinstance(reader.get('array').value, numpy.memmap)
+        assert reader.get('noise').value == noise
+    finally:
+        shutil.rmtree(root_dir)
+
+
+def test_file_cache_unknown_codec():
+    root_dir = tempfile.mkdtemp()
+    try:
+        with pytest.raises(ValueError):
+            reproducible.FileCache(root_dir, codec='rot13')
+    finally:
+        shutil.rmtree(root_dir)
+
+
+def test_file_cache_gc():
+    root_dir = tempfile.mkdtemp()
+    try:
+        cache = reproducible.FileCache(root_dir)
+        for i in range(10):
+            cache.set('key%d' % i, reproducible.get_data_wrapper(b'x' * 1000))
+            os.utime(cache.path('key%d' % i), (1000 + i, 1000 + i))
+
+        # Reading an entry marks it as recently used.
+        cache.get('key0')
+        abandoned = os.path.join(root_dir, cache.TEMPORARY_PREFIX + 'x')
+        open(abandoned, 'wb').close()
+        os.utime(abandoned, (0, 0))
+
+        result = cache.gc(max_entries=5)
+        assert result['removed']['entries'] == 5
+        assert result['remaining']['entries'] == 5
+        assert not os.path.exists(abandoned)
+        assert cache.is_cached('key0')
+        assert not cache.is_cached('key1')
+        assert cache.is_cached('key9')
+
+        size = os.path.getsize(cache.path('key9'))
+        result = cache.gc(max_bytes=3 * size)
+        assert result['remaining'] == {'entries': 3, 'bytes': 3 * size}
+        assert cache.is_cached('key0')
+
+        result = cache.gc(max_age=3600)
+        assert result['remaining']['entries'] == 1
+        assert cache.is_cached('key0')
+    finally:
+        shutil.rmtree(root_dir)
+
+
+def test_gc_command_line(capsys):
+    import reproducible.__main__
+
+    root_dir = tempfile.mkdtemp()
+    try:
+        cache = reproducible.FileCache(root_dir)
+        cache.set('foo', reproducible.get_data_wrapper(b'x' * 2000))
+        cache.set('bar', reproducible.get_data_wrapper(b'x' * 2000))
+        os.utime(cache.path('foo'), (0, 0))
+
+        assert reproducible.__main__.main(
+            ['gc', root_dir, '--max-bytes', '3K']) == 0
+        assert 'Removed 1 entries' in capsys.readouterr().out
+        assert not cache.is_cached('foo')
+        assert cache.is_cached('bar')
+
+        assert reproducible.__main__.main(
+            ['gc', os.path.join(root_dir, 'missing')]) == 1
     finally:
         shutil.rmtree(root_dir)
@@ -35,6 +35,13 @@ DATA_OBJECT_EXAMPLES = \
         for out_type, in_type in itertools.product(IO_TYPES, IO_TYPES)]
 
 
+@pytest.fixture(autouse=True)
+def file_hash_index(tmpdir):
+    index = reproducible.FileHashIndex(str(tmpdir.join('index.sqlite3')))
+    reproducible.set_file_hash_index(index)
+    return index
+
+
 def test_ignored_data():
     x = PlaceholderClass('x')
     x_ignored = reproducible.cache_ignore(x)
@@ -74,6 +81,40 @@ def test_file_data_update(monkeypatch):
     os.unlink(filename)
 
 
+def test_file_data_index(file_hash_index, tmpdir, monkeypatch):
+    filename = str(tmpdir.join('data'))
+    with open(filename, 'wb') as fh:
+        fh.write(b'foo')
+    os.utime(filename, (1000000000, 1000000000))
+    digest = '2c26b46b68ffc68ff99b453c1d30413413422d706483bfa0f98a5e886266e7ae'
+    assert reproducible.FileData(filename).cache_id(None) == digest
+
+    reproducible.set_file_hash_index(
+        reproducible.FileHashIndex(file_hash_index.path))
+
+    def fail(*args, **kwargs):
+        raise AssertionError('Unchanged file should not be read')
+
+    with monkeypatch.context() as m:
+        m.setattr('builtins.open', fail)
+        assert reproducible.FileData(filename).cache_id(None) == digest
+
+    with open(filename, 'wb') as fh:
+        fh.write(b'bar')
+    os.utime(filename, (1000000001, 1000000001))
+    assert reproducible.FileData(filename).cache_id(None) == \
+        'fcde2b2edba56bf408601fb721fe9b5c338d10ee429ea04fae5511b68fbf8fb9'
+
+
+def test_file_data_index_recent(file_hash_index, tmpdir):
+    filename = str(tmpdir.join('data'))
+    with open(filename, 'wb') as fh:
+        fh.write(b'foo')
+    reproducible.FileData(filename).cache_id(None)
+    key, _ = reproducible.data.hash_index.stat_key(filename)
+    assert file_hash_index.lookup(key) is None
+
+
 def test_object_data_strings():
     object_data_1 = reproducible.ObjectData('foo')
     object_data_2 = reproducible.ObjectData('foo')
@@ -189,7 +230,7 @@ def test_keras_model(out_type, in_type):
     if in_type == 'string':
         data_rt = reproducible.data.keras.ModelData.loads(serialised_data)
     elif in_type == 'file':
-        sio = io.StringIO(serialised_data.decode('utf8'))
+        sio = io.BytesIO(serialised_data)
         data_rt = reproducible.data.keras.ModelData.load(sio)
     else:
         raise ValueError("Invalid type parameter.")
@@ -201,3 +242,295 @@ def test_keras_model(out_type, in_type):
     assert len(weights_initial) == len(weights_roundtrip)
     for i in range(len(weights_initial)):
         assert (weights_initial[i] == weights_roundtrip[i]).all()
+
+
+@pytest.mark.slow
+def test_keras_model_legacy_format():
+    import base64
+    import json
+    import keras.models, keras.layers
+    import reproducible.data.keras
+    x = keras.models.Sequential([keras.layers.Dense(32, input_shape=(2, ))])
+
+    weights = []
+    for weight in x.get_weights():
+        sio = io.BytesIO()
+        numpy.save(sio, weight)
+        weights.append(base64.b64encode(sio.getvalue()).decode('ascii'))
+    legacy = json.dumps({
+        'weights': weights,
+        'architecture': x.to_json()
+    }).encode('utf8')
+
+    data_rt = reproducible.data.keras.ModelData.loads(legacy)
+    assert data_rt.value.get_config() == x.get_config()
+    assert data_rt.cache_id(None) == \
+        reproducible.get_data_wrapper(x).cache_id(None)
+
+
+@pytest.mark.slow
+def test_keras_model_file_cache():
+    import keras.models, keras.layers
+    import reproducible.data.keras
+    x = keras.models.Sequential([keras.layers.Dense(32, input_shape=(2, ))])
+    data = reproducible.get_data_wrapper(x)
+
+    with tempfile.TemporaryFile() as fh:
+        fh.write(b'x')
+        data.dump(fh)
+        fh.seek(1)
+        data_rt = reproducible.data.keras.ModelData.load(fh)
+    assert data_rt.cache_id(None) == data.cache_id(None)
+
+
+def test_array_data_cache_id():
+    x = numpy.random.randn(100, 2)
+    data_x1 = reproducible.get_data_wrapper(x)
+    data_x2 = reproducible.ArrayData(x.copy())
+    data_y = reproducible.ArrayData(x.reshape(2, 100))
+    data_z = reproducible.ArrayData(x.astype(numpy.float32))
+    data_t = reproducible.ArrayData(numpy.asfortranarray(x))
+
+    assert isinstance(data_x1, reproducible.ArrayData)
+    assert data_x1.cache_id(None) == data_x2.cache_id(None)
+    assert data_x1.cache_id(None) == data_t.cache_id(None)
+    assert data_x1.cache_id(None) != data_y.cache_id(None)
+    assert data_x1.cache_id(None) != data_z.cache_id(None)
+
+    structured_a = numpy.zeros(3, [('a', '<i4'), ('b', '<i4')])
+    structured_x = numpy.zeros(3, [('x', '<i8')])
+    assert reproducible.get_cache_id(structured_a) != \
+        reproducible.get_cache_id(structured_x)
+
+
+def test_array_subclass_data():
+    unmasked = numpy.ma.masked_array([1, 2, 3], mask=[0, 0, 0])
+    masked = numpy.ma.masked_array([1, 2, 3], mask=[1, 1, 1])
+    assert not isinstance(reproducible.get_data_wrapper(masked),
+                          reproducible.ArrayData)
+    assert reproducible.get_cache_id(masked) != \
+        reproducible.get_cache_id(unmasked)
+
+    data = reproducible.get_data_wrapper(masked)
+    data_rt = type(data).loads(data.dumps())
+    assert (data_rt.value.mask == masked.mask).all()
+
+    matrix = numpy.matrix([[1, 2], [3, 4]])
+    data = reproducible.get_data_wrapper(matrix)
+    assert type(type(data).loads(data.dumps()).value) is numpy.matrix
+
+
+@pytest.mark.parametrize('array', [
+    numpy.random.randn(100, 2),
+    numpy.asfortranarray(numpy.random.randn(100, 2)),
+    numpy.zeros(0),
+    numpy.array(['a', None], dtype=object),
+])
+def test_array_data_roundtrip(array):
+    data = reproducible.ArrayData(array)
+    assert data.cache_id(None) == \
+        reproducible.ArrayData.loads(data.dumps()).cache_id(None)
+
+    with tempfile.TemporaryFile() as fh:
+        data.dump(fh)
+        data.dump(fh)
+        fh.seek(0)
+        data_rt = reproducible.ArrayData.load(fh)
+        # The file must be left positioned after the array.
+        assert reproducible.ArrayData.load(fh).cache_id(None) == \
+            data.cache_id(None)
+    assert (data_rt.value == array).all()
+    assert data_rt.cache_id(None) == data.cache_id(None)
+
+
+def test_array_data_mmap():
+    x = numpy.random.randn(100, 2)
+    with tempfile.TemporaryFile() as fh:
+        fh.write(b'prefix')
+        reproducible.ArrayData(x).dump(fh)
+        fh.seek(len(b'prefix'))
+        data = reproducible.ArrayData.load(fh)
+    assert isinstance(data.value, numpy.memmap)
+    assert not data.value.flags.writeable
+    assert (data.value == x).all()
+
+
+def test_object_data_streaming_hash(monkeypatch):
+    x = [numpy.arange(1000), bytearray(b'foo')]
+    y = [numpy.arange(1000), bytearray(b'bar')]
+    expected = reproducible.ObjectData(x).cache_id(None)
+
+    def fail(self):
+        raise AssertionError('dumps() should not be used for hashing')
+
+    monkeypatch.setattr(reproducible.ObjectData, 'dumps', fail)
+    assert reproducible.ObjectData(x).cache_id(None) == expected
+    assert reproducible.ObjectData(y).cache_id(None) != expected
+
+
+def test_file_data_tree_hash(tmpdir):
+    filename = str(tmpdir.join('data'))
+    contents = os.urandom(10000)
+    with open(filename, 'wb') as fh:
+        fh.write(contents)
+
+    import hashlib
+    flat = reproducible.FileData(filename).cache_id(None)
+    assert flat == hashlib.sha256(contents).hexdigest()
+    assert reproducible.FileData(filename, tree_chunk_size=20000)\
+        .cache_id(None) == flat
+
+    tree_1 = reproducible.FileData(filename, tree_chunk_size=1000,
+                                   tree_workers=1).cache_id(None)
+    tree_4 = reproducible.FileData(filename, tree_chunk_size=1000,
+                                   tree_workers=4).cache_id(None)
+    tree_other = reproducible.FileData(filename, tree_chunk_size=3000)\
+        .cache_id(None)
+    assert tree_1 == tree_4
+    assert tree_1 != flat
+    assert tree_1 != tree_other
+
+
+def test_get_data_wrapper_most_specific(monkeypatch):
+    class Base(object):
+        pass
+
+    class Derived(Base):
+        pass
+
+    class BaseData(reproducible.ObjectData):
+        pass
+
+    class DerivedData(reproducible.ObjectData):
+        pass
+
+    monkeypatch.setattr(reproducible.data.generic, 'auto_type_registry',
+                        dict(reproducible.data.generic.auto_type_registry))
+    monkeypatch.setattr(reproducible.data.generic, '_handler_cache', {})
+
+    reproducible.register_type(Base, BaseData)
+    assert isinstance(reproducible.get_data_wrapper(Derived()), BaseData)
+    reproducible.register_type(Derived, DerivedData)
+    assert isinstance(reproducible.get_data_wrapper(Derived()), DerivedData)
+    assert isinstance(reproducible.get_data_wrapper(Base()), BaseData)
+    assert type(reproducible.get_data_wrapper(1)) is reproducible.ObjectData
+
+
+def test_object_data_structural(monkeypatch):
+    import collections
+    import dataclasses
+    import pickle
+
+    Point = collections.namedtuple('Point', ['x', 'y'])
+
+    @dataclasses.dataclass
+    class Config:
+        name: str
+        values: list
+
+    def cache_id(obj):
+        return reproducible.ObjectData(obj).cache_id(None)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('Structural values should not be pickled')
+
+    with monkeypatch.context() as m:
+        m.setattr(pickle, 'Pickler', fail)
+        values = [None, True, 1, 1.0, 1j, '1', b'1', bytearray(b'1'),
+                  (1, ), [1], {1}, frozenset([1]), {1: 1}, Point(1, 1),
+                  (1, 1), Config('a', [1]), [numpy.arange(3)]]
+        ids = [cache_id(value) for value in values]
+        assert len(set(ids)) == len(ids)
+
+        assert cache_id({'a': 1, 'b': [2, 3]}) == \
+            cache_id({'b': [2, 3], 'a': 1})
+        assert cache_id({'a', 'b', 'c'}) == cache_id({'c', 'b', 'a'})
+        assert cache_id([numpy.arange(3)]) == cache_id([numpy.arange(3)])
+        assert cache_id([numpy.arange(3)]) != cache_id([numpy.arange(4)])
+        assert cache_id(Config('a', [1])) != cache_id(Config('a', [2]))
+        assert cache_id(2**100) != cache_id(2**100 + 1)
+
+    # Self-referential values fall back to pickling.
+    x = [1]
+    x.append(x)
+    assert cache_id(x) == cache_id(x)
+
+
+def test_frozen_cache_id(monkeypatch):
+    x = numpy.arange(1000)
+    y = [1, 2, 3]
+    assert reproducible.freeze(x) is x
+    assert reproducible.freeze(y) is y
+    assert not x.flags.writeable
+    x_id = reproducible.get_cache_id(x)
+    y_id = reproducible.get_cache_id(y)
+
+    calls = []
+    cache_id = reproducible.ArrayData.cache_id
+
+    def counting_cache_id(self, _):
+        calls.append(self)
+        return cache_id(self, _)
+
+    monkeypatch.setattr(reproducible.ArrayData, 'cache_id',
+                        counting_cache_id)
+    assert reproducible.get_cache_id(x) == x_id
+    assert reproducible.get_cache_id([x]) == reproducible.get_cache_id([x])
+    assert calls == []
+    assert reproducible.get_cache_id(y) == y_id
+
+    # Arrays that become writeable are hashed again.
+    x.flags.writeable = True
+    x[0] = 1
+    assert reproducible.get_cache_id(x) != x_id
+    assert len(calls) == 1
+
+    reproducible.unfreeze(y)
+    y.append(4)
+    assert reproducible.get_cache_id(y) != y_id
+
+
+def test_frozen_array_modified_while_writeable():
+    x = reproducible.freeze(numpy.zeros(5))
+    x_id = reproducible.get_cache_id(x)
+
+    x.flags.writeable = True
+    x[0] = 5
+    x.flags.writeable = False
+    assert reproducible.get_cache_id(x) != x_id
+    assert reproducible.get_cache_id(x) == \
+        reproducible.get_cache_id(numpy.array([5.0, 0, 0, 0, 0]))
+
+    # Memory owned by a read-only buffer cannot change, so is not checked.
+    y = reproducible.freeze(numpy.frombuffer(b'\0' * 40))
+    reproducible.get_cache_id(y)
+    assert reproducible.data.generic._frozen[id(y)].checksum is None
+
+
+def test_frozen_view_of_writeable_array():
+    base = numpy.arange(1000)
+    view = reproducible.freeze(base[:500])
+    assert not view.flags.writeable
+    view_id = reproducible.get_cache_id(view)
+
+    # The view changes through its base, so it must be hashed again.
+    base[0] = 1
+    assert reproducible.get_cache_id(view) != view_id
+
+    base.flags.writeable = False
+    view_id = reproducible.get_cache_id(view)
+    entry = reproducible.data.generic._frozen[id(view)]
+    assert entry.cache_id == view_id
+
+
+def test_frozen_weakref():
+    class Placeholder(object):
+        pass
+
+    x = reproducible.freeze(Placeholder())
+    key = id(x)
+    assert key in reproducible.data.generic._frozen
+    del x
+    import gc
+    gc.collect()
+    assert key not in reproducible.data.generic._frozen
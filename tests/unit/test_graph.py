@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+from __future__ import absolute_import, division, print_function, \
+    unicode_literals
+
+import pytest
+import reproducible
+import time
+
+calls = []
+
+
+@reproducible.operation
+def load(x):
+    calls.append('load')
+    time.sleep(0.02)
+    return [x]
+
+
+@reproducible.operation
+def slow_double(x):
+    calls.append('slow_double')
+    time.sleep(0.1)
+    return x * 2
+
+
+@reproducible.operation
+def fast_reverse(x):
+    calls.append('fast_reverse')
+    return x[::-1]
+
+
+@reproducible.operation
+def combine(x, y):
+    calls.append('combine')
+    return x + y
+
+
+@reproducible.operation
+def fail(x):
+    raise ValueError(x)
+
+
+@pytest.fixture
+def memory_cache():
+    cache = reproducible.MemoryCache()
+    reproducible.set_cache(cache)
+    del calls[:]
+    return cache
+
+
+def build(graph, x):
+    data = graph.add(load, x)
+    doubled = graph.add(slow_double, data)
+    reversed_ = graph.add(fast_reverse, data)
+    assert graph.add(slow_double, data) is doubled
+    return data, doubled, reversed_, graph.add(combine, doubled, reversed_)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_graph_run(memory_cache, workers):
+    graph = reproducible.Graph()
+    data, doubled, reversed_, combined = build(graph, 1)
+    assert len(graph.nodes) == 4
+    assert calls == []
+
+    graph.run(workers=workers)
+    assert sorted(calls) == ['combine', 'fast_reverse', 'load', 'slow_double']
+    assert combined.value == [1, 1, 1]
+    assert all(node.state == 'computed' for node in graph.nodes.values())
+
+    seconds, path = graph.critical_path()
+    assert path == [data, doubled, combined]
+    assert seconds >= 0.12
+
+    # A new graph with the same calls finds the final result cached, and
+    # runs nothing upstream of it.
+    del calls[:]
+    graph = reproducible.Graph()
+    data, doubled, reversed_, combined = build(graph, 1)
+    graph.run(workers=workers)
+    assert calls == []
+    assert combined.state == 'cached'
+    assert data.state is None
+    assert graph.critical_path() == (0.0, [])
+    assert combined.value == [1, 1, 1]
+    assert calls == []
+
+
+def test_graph_partial(memory_cache):
+    graph = reproducible.Graph()
+    build(graph, 1)
+    graph.run()
+
+    del calls[:]
+    graph = reproducible.Graph()
+    data, doubled, reversed_, combined = build(graph, 1)
+    other = graph.add(combine, doubled, graph.add(load, 2))
+    graph.run(targets=[other])
+    assert sorted(calls) == ['combine', 'load']
+    assert doubled.state == 'cached'
+    assert other.value == [1, 1, 2]
+    assert combined.state is None
+
+
+def test_graph_keys_match_lazy_calls(memory_cache):
+    graph = reproducible.Graph()
+    node = graph.add(slow_double, graph.add(load, 1))
+    lazy_load = reproducible.operation(lazy=True)(load.__wrapped__)
+    assert node.cache_key == slow_double.cache_key(lazy_load(1))
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_graph_failure(memory_cache, workers):
+    graph = reproducible.Graph()
+    failed = graph.add(fail, graph.add(load, 1))
+    graph.add(combine, failed, failed)
+    with pytest.raises(ValueError):
+        graph.run(workers=workers)
+    assert 'combine' not in calls
+
+    with pytest.raises(TypeError):
+        graph.add(len, [])
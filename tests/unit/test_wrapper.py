@@ -3,6 +3,7 @@
 from __future__ import absolute_import, division, print_function, \
     unicode_literals
 
+import os
 import pytest
 import reproducible
 import shutil
@@ -115,3 +116,495 @@ def test_wrapper_file_cache(memory_cache):
         assert side_effects == 1
     finally:
         shutil.rmtree(root_dir)
+
+
+def test_wrapper_source_hash_memoised(memory_cache, monkeypatch):
+    reproducible.set_cache(memory_cache)
+
+    @reproducible.operation
+    def qux(x):
+        return x
+
+    import inspect
+    getsource = inspect.getsource
+    calls = []
+
+    def counting_getsource(obj):
+        calls.append(obj)
+        return getsource(obj)
+
+    monkeypatch.setattr(inspect, 'getsource', counting_getsource)
+
+    qux(0)
+    qux(0)
+    qux(1)
+    assert len(calls) == 1
+
+    monkeypatch.setattr('os.stat', lambda x: os.stat_result((0, ) * 10))
+    qux(0)
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize('cache_type', ['memory', 'file'])
+def test_wrapper_single_flight(cache_type):
+    import threading
+    import time
+
+    root_dir = tempfile.mkdtemp()
+    try:
+        if cache_type == 'memory':
+            reproducible.set_cache(reproducible.MemoryCache())
+        else:
+            reproducible.set_cache(reproducible.FileCache(root_dir))
+
+        calls = []
+
+        @reproducible.operation
+        def slow(x):
+            calls.append(x)
+            time.sleep(0.2)
+            return x
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(slow(1)))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert calls == [1]
+        assert results == [1, 1, 1, 1]
+    finally:
+        shutil.rmtree(root_dir)
+
+
+@pytest.mark.parametrize('cache_type', ['memory', 'bounded', 'file', 'tiered',
+                                        'sqlite'])
+def test_wrapper_cache_backends(cache_type):
+    root_dir = tempfile.mkdtemp()
+    try:
+        cache = {
+            'memory': lambda: reproducible.MemoryCache(),
+            'bounded': lambda: reproducible.BoundedMemoryCache(
+                max_entries=10),
+            'file': lambda: reproducible.FileCache(root_dir),
+            'tiered': lambda: reproducible.TieredCache(
+                reproducible.FileCache(root_dir)),
+            'sqlite': lambda: reproducible.SqliteCache(
+                os.path.join(root_dir, 'cache.db')),
+        }[cache_type]()
+        reproducible.set_cache(cache)
+
+        calls = []
+
+        @reproducible.operation
+        def double(x):
+            calls.append(x)
+            return 2 * x
+
+        assert double(1) == 2
+        assert double(2) == 4
+        assert double(1) == 2
+        assert calls == [1, 2]
+        if cache_type == 'sqlite':
+            cache.flush()
+    finally:
+        shutil.rmtree(root_dir)
+
+
+def test_wrapper_stats():
+    import io
+    import json
+
+    root_dir = tempfile.mkdtemp()
+    try:
+        reproducible.set_cache(reproducible.FileCache(root_dir))
+        reproducible.reset_stats()
+
+        @reproducible.operation
+        def counted(x):
+            return x * 2
+
+        counted(1)
+        assert reproducible.stats() == {}
+
+        reproducible.enable_stats()
+        try:
+            counted(1)
+            counted(2)
+            counted(2)
+        finally:
+            reproducible.disable_stats()
+        counted(3)
+
+        record = reproducible.stats()[__name__ + '.' +
+                                      counted.__qualname__]
+        assert record['hits'] == 2
+        assert record['misses'] == 1
+        assert record['bytes_read'] > 0
+        assert record['bytes_written'] > 0
+        for field in ('hash_time', 'lookup_time', 'deserialize_time',
+                      'compute_time', 'store_time'):
+            assert record[field] >= 0
+
+        sio = io.StringIO()
+        reproducible.dump_stats(sio)
+        assert json.loads(sio.getvalue()) == reproducible.stats()
+    finally:
+        reproducible.reset_stats()
+        shutil.rmtree(root_dir)
+
+
+@pytest.mark.parametrize('cache_type', ['memory', 'file'])
+def test_wrapper_map(cache_type):
+    root_dir = tempfile.mkdtemp()
+    try:
+        if cache_type == 'memory':
+            reproducible.set_cache(reproducible.MemoryCache())
+        else:
+            reproducible.set_cache(reproducible.FileCache(root_dir))
+
+        calls = []
+
+        @reproducible.operation
+        def add(x, y, offset=0):
+            calls.append((x, y, offset))
+            return x + y + offset
+
+        assert add(1, 2) == 3
+        assert add.map([1, 2, 3, 2], [2, 3, 4, 3]) == [3, 5, 7, 5]
+        assert calls == [(1, 2, 0), (2, 3, 0), (3, 4, 0)]
+
+        assert add.map([1, 2], [2, 3], offset=10) == [13, 15]
+        assert add.map([3], [4]) == [7]
+        assert add(1, 2, offset=10) == 13
+        assert len(calls) == 5
+        assert add.map([]) == []
+    finally:
+        shutil.rmtree(root_dir)
+
+
+executor_calls = []
+
+
+def _record_call(x):
+    executor_calls.append(x)
+    return x * 2
+
+
+@pytest.mark.parametrize('executor_type', ['thread', 'process'])
+def test_wrapper_executor(executor_type):
+    import concurrent.futures
+    import multiprocessing
+
+    root_dir = tempfile.mkdtemp()
+    try:
+        reproducible.set_cache(reproducible.FileCache(root_dir))
+        if executor_type == 'thread':
+            executor = concurrent.futures.ThreadPoolExecutor(4)
+        else:
+            # Workers must inherit the functions defined below.
+            executor = concurrent.futures.ProcessPoolExecutor(
+                2, mp_context=multiprocessing.get_context('fork'))
+
+        def decorate(name, **kwargs):
+            # Process pools find the decorated function by name.
+            decorated = reproducible.operation(**kwargs)(_record_call)
+            decorated.__name__ = decorated.__qualname__ = name
+            globals()[name] = decorated
+            return decorated
+
+        with executor:
+            double = decorate('double', executor=executor)
+            blocking = decorate('blocking', executor=executor,
+                                blocking=True)
+            del executor_calls[:]
+
+            future = double(1)
+            assert future.result() == 2
+            assert double(1).done()
+            assert double(1).result() == 2
+
+            futures = double.map([1, 2, 3, 2])
+            assert [f.result() for f in futures] == [2, 4, 6, 4]
+
+            assert blocking.map([1, 4]) == [2, 8]
+            assert blocking(4) == 8
+
+        if executor_type == 'thread':
+            assert sorted(executor_calls) == [1, 2, 3, 4]
+
+        reproducible.set_cache(reproducible.FileCache(root_dir))
+        assert reproducible.operation(_record_call).map([1, 2, 3, 4]) == \
+            [2, 4, 6, 8]
+    finally:
+        globals().pop('double', None)
+        globals().pop('blocking', None)
+        shutil.rmtree(root_dir)
+
+
+def test_wrapper_executor_exception():
+    import concurrent.futures
+
+    reproducible.set_cache(reproducible.MemoryCache())
+    calls = []
+
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        @reproducible.operation(executor=executor)
+        def fail(x):
+            calls.append(x)
+            raise ValueError(x)
+
+        with pytest.raises(ValueError):
+            fail(1).result()
+        with pytest.raises(ValueError):
+            fail(1).result()
+    assert calls == [1, 1]
+
+
+@pytest.mark.parametrize('cache_type', ['memory', 'file'])
+def test_wrapper_coroutine(cache_type):
+    import asyncio
+    import inspect
+
+    root_dir = tempfile.mkdtemp()
+    try:
+        if cache_type == 'memory':
+            reproducible.set_cache(reproducible.MemoryCache())
+        else:
+            reproducible.set_cache(reproducible.FileCache(root_dir))
+
+        calls = []
+
+        @reproducible.operation
+        async def load(x):
+            calls.append(x)
+            await asyncio.sleep(0.05)
+            return [x]
+
+        assert inspect.iscoroutinefunction(load)
+
+        async def main():
+            assert await load(1) == [1]
+            assert await load(1) == [1]
+            assert calls == [1]
+
+            results = await asyncio.gather(*[load(2) for _ in range(4)])
+            assert results == [[2]] * 4
+            assert calls == [1, 2]
+
+            assert await load.map([1, 3, 3, 4]) == [[1], [3], [3], [4]]
+            assert sorted(calls) == [1, 2, 3, 4]
+
+        asyncio.run(main())
+
+        with pytest.raises(TypeError):
+            reproducible.operation(executor=object())(load.__wrapped__)
+    finally:
+        shutil.rmtree(root_dir)
+
+
+def test_wrapper_dependencies(memory_cache):
+    import importlib
+    import sys
+    import time
+
+    reproducible.set_cache(memory_cache)
+    root_dir = tempfile.mkdtemp()
+
+    def write(name, source):
+        path = os.path.join(root_dir, name + '.py')
+        with open(path, 'w') as fh:
+            fh.write(source)
+        # Make sure that the modification time changes.
+        now = time.time() + len(memory_cache.cache)
+        os.utime(path, (now, now))
+
+    helpers_source = (
+        'import threading\n'
+        '\n'
+        'SCALE = 2\n'
+        'RESOURCES = {\'lock\': threading.Lock()}\n'
+        '\n'
+        '\n'
+        'def scale(x):\n'
+        '    with RESOURCES[\'lock\']:\n'
+        '        return x * SCALE\n')
+    write('dependency_helpers', helpers_source)
+    write('dependency_operations', (
+        'import reproducible\n'
+        'import dependency_helpers\n'
+        'from dependency_helpers import scale\n'
+        '\n'
+        '\n'
+        '@reproducible.operation\n'
+        'def direct(x):\n'
+        '    return scale(x) + 1\n'
+        '\n'
+        '\n'
+        '@reproducible.operation\n'
+        'def through_module(x):\n'
+        '    return dependency_helpers.scale(x)\n'
+        '\n'
+        '\n'
+        '@reproducible.operation\n'
+        'def independent(x):\n'
+        '    return x\n'))
+
+    sys.path.insert(0, root_dir)
+    try:
+        import dependency_helpers
+        import dependency_operations
+
+        def call_all():
+            return (dependency_operations.direct(1),
+                    dependency_operations.through_module(1),
+                    dependency_operations.independent(1))
+
+        assert call_all() == (3, 2, 1)
+        assert len(memory_cache.cache) == 3
+        assert call_all() == (3, 2, 1)
+        assert len(memory_cache.cache) == 3
+
+        # Editing the helper invalidates only the operations using it.
+        write('dependency_helpers', helpers_source.replace(
+            'x * SCALE', 'x * SCALE * 10'))
+        importlib.reload(dependency_helpers)
+        importlib.reload(dependency_operations)
+        assert call_all() == (21, 20, 1)
+        assert len(memory_cache.cache) == 5
+
+        # So does changing a constant that it uses.
+        write('dependency_helpers', helpers_source.replace(
+            'SCALE = 2', 'SCALE = 3'))
+        importlib.reload(dependency_helpers)
+        importlib.reload(dependency_operations)
+        assert call_all() == (4, 3, 1)
+        assert len(memory_cache.cache) == 7
+
+        # Changing unrelated code invalidates nothing.
+        write('dependency_helpers', helpers_source.replace(
+            'SCALE = 2', 'SCALE = 3') + '\n\ndef unused():\n    pass\n')
+        importlib.reload(dependency_helpers)
+        importlib.reload(dependency_operations)
+        assert call_all() == (4, 3, 1)
+        assert len(memory_cache.cache) == 7
+    finally:
+        sys.path.remove(root_dir)
+        sys.modules.pop('dependency_helpers', None)
+        sys.modules.pop('dependency_operations', None)
+        shutil.rmtree(root_dir)
+
+
+def test_wrapper_dependencies_without_file(memory_cache, monkeypatch):
+    import sys
+    import types
+
+    from reproducible import dependencies
+
+    # Code run in a notebook cell lives in a __main__ module with no file.
+    main = types.ModuleType('__main__')
+    monkeypatch.setitem(sys.modules, '__main__', main)
+    monkeypatch.setattr(dependencies, '_user_modules', {})
+    reproducible.set_cache(memory_cache)
+
+    def run_cell(source):
+        exec(compile(source, '<cell>', 'exec'), vars(main))
+
+    run_cell('def g(x):\n'
+             '    return x + 1\n')
+    run_cell('import reproducible\n'
+             '\n'
+             '\n'
+             '@reproducible.operation\n'
+             'def f(x):\n'
+             '    return g(x)\n')
+    assert main.f(1) == 2
+    assert main.f(1) == 2
+    assert len(memory_cache.cache) == 1
+
+    run_cell('def g(x):\n'
+             '    return x + 100\n')
+    assert main.f(1) == 101
+    assert len(memory_cache.cache) == 2
+
+
+def test_wrapper_lazy():
+    class CountingCache(reproducible.MemoryCache):
+        loads = 0
+
+        def get_or_miss(self, key):
+            CountingCache.loads += 1
+            return super(CountingCache, self).get_or_miss(key)
+
+    cache = CountingCache()
+    reproducible.set_cache(cache)
+    calls = []
+
+    @reproducible.operation(lazy=True)
+    def first(x):
+        calls.append('first')
+        return [x]
+
+    @reproducible.operation(lazy=True)
+    def second(x):
+        calls.append('second')
+        return x + [2]
+
+    @reproducible.operation
+    def third(x):
+        calls.append('third')
+        return x + [3]
+
+    result = second(first(1))
+    assert isinstance(result, reproducible.LazyData)
+    assert result.value == [1, 2]
+    assert third(result) == [1, 2, 3]
+    assert calls == ['first', 'second', 'third']
+
+    # A cached chain loads nothing until its value is used.
+    CountingCache.loads = 0
+    result = second(first(1))
+    assert not result.is_loaded
+    assert CountingCache.loads == 0
+    assert result.value == [1, 2]
+    assert CountingCache.loads == 1
+    assert reproducible.get_cache_id(result) == result.cache_key
+
+    # Entries removed after they were found are computed again.
+    result = second(first(1))
+    del cache.cache[result.cache_key]
+    assert result.value == [1, 2]
+    assert calls == ['first', 'second', 'third', 'second']
+
+    results = second.map([first(1), first(4)])
+    assert [r.value for r in results] == [[1, 2], [4, 2]]
+    assert calls[-1] == 'second' and len(calls) == 6
+
+    with pytest.raises(TypeError):
+        reproducible.operation(lazy=True, executor=object())(third)
+
+
+def test_lazy_data_threads():
+    import threading
+    import time
+
+    loads = []
+
+    def load():
+        loads.append(None)
+        time.sleep(0.1)
+        return 'value'
+
+    data = reproducible.LazyData('key', load)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(data.value))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ['value'] * 8
+    assert len(loads) == 1